@@ -0,0 +1,136 @@
+"""
+Benchmark the template parser on synthetic sites.
+
+Usage:
+    python -m benchmarks.bench_parse_tree [--files 1000 10000 ...]
+        [--depth 3] [--fanout 4] [--chain-length 2] [--repeat 3]
+        [--output results.json] [--compare previous.json]
+
+Sites are generated in temporary directories, so the benchmark runs
+offline. Results are printed, and written as JSON with --output. Pass the
+JSON of an earlier run with --compare to print the change of each result.
+"""
+
+import argparse
+import json
+import platform
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from benchmarks.site_generator import generate_site
+from webapp.parse_tree import (
+    TemplateGraph,
+    get_tags_rolling_buffer,
+    scan_directory,
+)
+
+
+def best_time(func, repeat):
+    """Return the best time of a number of runs of func, in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def peak_memory(func):
+    """Return the peak memory allocated by a run of func, in bytes"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_site(templates, repeat):
+    """
+    Time the parser functions on a templates folder.
+    """
+    templates = str(templates)
+    pages = [
+        path
+        for path in sorted(Path(templates).rglob("*.html"))
+        if not path.name.startswith("_")
+    ]
+
+    def get_tags():
+        for path in pages:
+            get_tags_rolling_buffer(path)
+
+    def extends_base():
+        graph = TemplateGraph(templates)
+        for path in pages:
+            graph.extends_base(path)
+
+    return {
+        "pages": len(pages),
+        "scan_directory_seconds": best_time(
+            lambda: scan_directory(templates), repeat
+        ),
+        "get_tags_rolling_buffer_seconds": best_time(get_tags, repeat),
+        "extends_base_seconds": best_time(extends_base, repeat),
+        "scan_directory_peak_memory_bytes": peak_memory(
+            lambda: scan_directory(templates)
+        ),
+    }
+
+
+def compare(results, previous):
+    """
+    Print the change of each result from an earlier run.
+    """
+    if previous["site"] != results["site"]:
+        print("Warning: the earlier run used different site options")
+    previous_runs = {run["files"]: run for run in previous["runs"]}
+    for run in results["runs"]:
+        if not (previous_run := previous_runs.get(run["files"])):
+            continue
+        for key, value in run["results"].items():
+            if old_value := previous_run["results"].get(key):
+                change = value / old_value - 1
+                print(f"{run['files']} files, {key}: {change:+.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--files", type=int, nargs="+", default=[1000])
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=4)
+    parser.add_argument("--chain-length", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="File to write JSON results to")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    args = parser.parse_args()
+
+    site = {
+        "depth": args.depth,
+        "fanout": args.fanout,
+        "chain_length": args.chain_length,
+    }
+    results = {"python": platform.python_version(), "site": site, "runs": []}
+    for files in args.files:
+        with tempfile.TemporaryDirectory() as root:
+            templates = generate_site(root, files=files, **site)
+            run = {
+                "files": files,
+                "results": benchmark_site(templates, args.repeat),
+            }
+        results["runs"].append(run)
+        print(json.dumps(run))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
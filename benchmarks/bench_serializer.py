@@ -0,0 +1,175 @@
+"""
+Benchmark the serialization of webpages to tree dicts.
+
+Usage:
+    python -m benchmarks.bench_serializer [--pages 5000] [--users 50]
+        [--repeat 5]
+
+Webpages, with reviewers and jira tasks, are created in an in-memory
+SQLite database. The serializer is compared with the implementation of
+convert_webpage_to_dict it replaced, which copied the __dict__ of every
+object, and both are checked to give the same JSON.
+"""
+
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from webapp.helper import get_project_webpages
+from webapp.models import (
+    Base,
+    JiraTask,
+    Project,
+    Reviewer,
+    User,
+    Webpage,
+    WebpageStatus,
+)
+from webapp.serializers import TreeSerializer
+
+
+def serialize_legacy(webpage):
+    """
+    Serialize a webpage the way convert_webpage_to_dict did before the
+    serializer was introduced.
+    """
+    webpage_dict = webpage.__dict__.copy()
+    webpage_dict.pop("_sa_instance_state", None)
+    webpage_dict.pop("owner_id", None)
+    webpage_dict.pop("project_id", None)
+    owner = webpage_dict.pop("owner", None)
+    project = webpage_dict.pop("project", None)
+    reviewers = webpage_dict.pop("reviewers", None)
+    jira_tasks = webpage_dict.pop("jira_tasks", None)
+
+    owner_dict = {}
+    if owner:
+        owner_dict = owner.__dict__.copy()
+        owner_dict["created_at"] = owner.created_at.isoformat()
+        owner_dict["updated_at"] = owner.updated_at.isoformat()
+        owner_dict.pop("_sa_instance_state", None)
+
+    project_dict = {}
+    if project:
+        project_dict = project.__dict__.copy()
+        project_dict["created_at"] = project.created_at.isoformat()
+        project_dict["updated_at"] = project.updated_at.isoformat()
+        project_dict.pop("_sa_instance_state", None)
+
+    def expand(item):
+        item_dict = item.__dict__.copy()
+        item_dict.pop("_sa_instance_state", None)
+        item_dict.pop("user", None)
+        item_dict.pop("webpages", None)
+        item_dict["created_at"] = item.created_at.isoformat()
+        item_dict["updated_at"] = item.updated_at.isoformat()
+        user_dict = item.user.__dict__.copy()
+        user_dict.pop("created_at")
+        user_dict.pop("updated_at")
+        user_dict.pop("_sa_instance_state", None)
+        return {**item_dict, **user_dict}
+
+    webpage_dict["status"] = webpage.status.value
+    webpage_dict["created_at"] = webpage.created_at.isoformat()
+    webpage_dict["updated_at"] = webpage.updated_at.isoformat()
+    webpage_dict["owner"] = owner_dict
+    webpage_dict["project"] = project_dict
+    webpage_dict["reviewers"] = [expand(item) for item in reviewers or []]
+    webpage_dict["jira_tasks"] = [expand(item) for item in jira_tasks or []]
+    return webpage_dict
+
+
+def create_webpages(session, pages, users):
+    """
+    Create a project with webpages, a third of them with a reviewer and a
+    fifth of them with a jira task, and return the project id.
+    """
+    rng = random.Random(0)
+    now = datetime.now(timezone.utc)
+    project = Project(name="ubuntu.com", created_at=now, updated_at=now)
+    owners = [
+        User(name=f"User {n}", email=f"user{n}@example.com", hrc_id=n)
+        for n in range(users)
+    ]
+    session.add_all([project, *owners])
+    session.flush()
+    for number in range(pages):
+        webpage = Webpage(
+            name=f"/page-{number}",
+            url=f"/page-{number}",
+            title=f"Page {number}",
+            description="Description",
+            project_id=project.id,
+            owner_id=rng.choice(owners).id,
+            status=WebpageStatus.AVAILABLE,
+        )
+        session.add(webpage)
+        session.flush()
+        if number % 3 == 0:
+            session.add(
+                Reviewer(user_id=rng.choice(owners).id, webpage_id=webpage.id)
+            )
+        if number % 5 == 0:
+            session.add(
+                JiraTask(
+                    jira_id=f"WD-{number}",
+                    webpage_id=webpage.id,
+                    user_id=rng.choice(owners).id,
+                    summary=f"Copy update /page-{number}",
+                )
+            )
+    session.commit()
+    return project.id
+
+
+def best_time(func, repeat):
+    """Return the best time of a number of runs of func, in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        project_id = create_webpages(session, args.pages, args.users)
+        webpages = get_project_webpages(session, project_id)
+
+        def legacy():
+            return [serialize_legacy(webpage) for webpage in webpages]
+
+        def serializer():
+            tree_serializer = TreeSerializer()
+            return [
+                tree_serializer.serialize_webpage(webpage)
+                for webpage in webpages
+            ]
+
+        assert json.dumps(legacy(), sort_keys=True) == json.dumps(
+            serializer(), sort_keys=True
+        )
+        legacy_time = best_time(legacy, args.repeat)
+        serializer_time = best_time(serializer, args.repeat)
+
+    print(f"legacy: {legacy_time * 1000:.1f}ms for {args.pages} webpages")
+    print(f"serializer: {serializer_time * 1000:.1f}ms")
+    print(f"speedup: {legacy_time / serializer_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Count the filesystem calls made when walking a templates tree.
+
+The walker in scan_directory is compared with the walker it replaced,
+which checked for an index.html, listed the directory and then called
+is_file() and is_dir() on each entry.
+
+Usage: python -m benchmarks.scan_syscalls [templates_folder]
+
+Without a templates folder, a synthetic site is created in a temporary
+directory. Calls are counted at the Python level, and DirEntry type checks
+are assumed to be served from the listing, as they are on filesystems that
+report entry types.
+"""
+
+import io
+import os
+import sys
+import tempfile
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+from benchmarks.site_generator import generate_site
+from webapp.parse_tree import scan_directory
+
+COUNTED_CALLS = ["stat", "lstat", "listdir", "scandir"]
+
+
+@contextmanager
+def count_calls():
+    """
+    Count the calls made to os filesystem functions and to io.open.
+    """
+    counts = Counter()
+    modules = [(os, name) for name in COUNTED_CALLS] + [(io, "open")]
+    originals = {name: getattr(module, name) for module, name in modules}
+
+    def counted(name, func):
+        def wrapper(*args, **kwargs):
+            counts[name] += 1
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    for module, name in modules:
+        setattr(module, name, counted(name, originals[name]))
+    try:
+        yield counts
+    finally:
+        for module, name in modules:
+            setattr(module, name, originals[name])
+
+
+def walk_legacy(path):
+    """
+    Walk a templates tree making the same filesystem calls as the walker
+    that scan_directory used before it was rebuilt on os.scandir.
+    """
+    path = Path(path)
+    (path / "index.html").exists()
+    for child in path.iterdir():
+        if child.is_file() and child.name != "index.html":
+            pass
+        if child.is_dir():
+            walk_legacy(child)
+
+
+def report(name, counts):
+    total = sum(counts[call] for call in COUNTED_CALLS)
+    calls = ", ".join(f"{call}={counts[call]}" for call in COUNTED_CALLS)
+    print(f"{name}: {calls}, total={total}, open={counts['open']}")
+    return total
+
+
+def main(templates_folder):
+    templates_folder = str(Path(templates_folder).absolute())
+
+    with count_calls() as counts:
+        walk_legacy(templates_folder)
+    legacy = report("legacy walker", counts)
+
+    with count_calls() as counts:
+        scan_directory(templates_folder)
+    current = report("scan_directory", counts)
+
+    print(f"filesystem calls reduced by {1 - current / legacy:.0%}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(sys.argv[1])
+    else:
+        with tempfile.TemporaryDirectory() as root:
+            main(generate_site(root))
@@ -0,0 +1,100 @@
+"""
+Generate synthetic site templates to benchmark the template parser.
+"""
+
+from itertools import product
+from pathlib import Path
+
+PAGE = """{{% extends "{extends}" %}}
+
+{{% block title %}}{title}{{% endblock %}}
+
+{{% block meta_description %}}
+  A synthetic page, {title}, generated to benchmark the template parser.
+{{% endblock %}}
+{copydoc}
+{{% block content %}}
+<section class="p-strip">
+{content}
+</section>
+{{% endblock content %}}
+"""
+LAYOUT = """{{% extends "{extends}" %}}
+
+{{% block meta_copydoc %}}https://docs.google.com/document/d/{name}
+{{% endblock meta_copydoc %}}
+"""
+
+
+def get_directories(depth, fanout):
+    """
+    Return the paths of the directories of a tree with the given depth and
+    number of subdirectories per directory, parents first.
+    """
+    directories = [()]
+    for level in range(1, depth + 1):
+        for parts in product(range(fanout), repeat=level):
+            directories.append(tuple(f"section-{part}" for part in parts))
+    return [Path(*parts) for parts in directories]
+
+
+def write_page(path, extends, title, copydoc=False):
+    path.write_text(
+        PAGE.format(
+            extends=extends,
+            title=title,
+            copydoc=(
+                f"{{% block meta_copydoc %}}https://docs.google.com/{title}"
+                "{% endblock %}"
+                if copydoc
+                else ""
+            ),
+            content="\n".join(f"  <p>Paragraph {i}</p>" for i in range(40)),
+        )
+    )
+
+
+def generate_site(root, files=1000, depth=3, fanout=4, chain_length=2):
+    """
+    Write a templates folder with about the given number of files in root,
+    and return its path.
+
+    Pages are spread evenly across the directories of a tree with the given
+    depth and fanout. Each directory has an index page, and all pages
+    extend a layout that reaches the base template through a chain of
+    chain_length layouts.
+    """
+    templates = Path(root) / "templates"
+    (templates / "templates").mkdir(parents=True)
+    (templates / "templates" / "base.html").write_text(
+        "<html>{% block content %}{% endblock %}</html>"
+    )
+
+    # Each layout extends the previous one
+    extends = "templates/base.html"
+    for number in range(chain_length):
+        name = f"_base_layout_{number}.html"
+        layout = LAYOUT.format(extends=extends, name=name)
+        (templates / name).write_text(layout)
+        extends = f"/{name}"
+
+    directories = get_directories(depth, fanout)
+    pages = max(files - chain_length - 1, len(directories))
+    for number, directory in enumerate(directories):
+        folder = templates / directory
+        folder.mkdir(parents=True, exist_ok=True)
+        name = directory.as_posix() if directory.parts else "home"
+        write_page(folder / "index.html", extends, f"{name} index")
+        # Spread the remaining pages evenly across the directories
+        count = pages // len(directories) - 1
+        if number < pages % len(directories):
+            count += 1
+        for page in range(count):
+            write_page(
+                folder / f"page-{page}.html",
+                extends,
+                f"{name} page {page}",
+                copydoc=page % 2 == 0,
+            )
+
+    return templates
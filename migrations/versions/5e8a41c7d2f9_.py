@@ -0,0 +1,53 @@
+"""Add the ancestor path of webpages
+
+Revision ID: 5e8a41c7d2f9
+Revises: 2cebdd533a59
+Create Date: 2026-10-17 18:40:12.503218
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.sql import text
+
+# revision identifiers, used by Alembic.
+revision = "5e8a41c7d2f9"
+down_revision = "2cebdd533a59"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("webpages", schema=None) as batch_op:
+        batch_op.add_column(sa.Column("path", sa.String(), nullable=True))
+        batch_op.create_index(
+            "ix_webpages_path",
+            ["path"],
+            unique=False,
+            postgresql_ops={"path": "varchar_pattern_ops"},
+        )
+
+    # Set the path of existing webpages from their parents
+    conn = op.get_bind()
+    conn.execute(
+        text("""
+        WITH RECURSIVE tree (id, path) AS (
+            SELECT id, CAST('/' AS VARCHAR)
+            FROM webpages
+            WHERE parent_id IS NULL
+            UNION ALL
+            SELECT webpages.id,
+                CAST(tree.path || tree.id || '/' AS VARCHAR)
+            FROM webpages
+            JOIN tree ON webpages.parent_id = tree.id
+        )
+        UPDATE webpages
+        SET path = (SELECT tree.path FROM tree WHERE tree.id = webpages.id);
+    """)
+    )
+
+
+def downgrade():
+    with op.batch_alter_table("webpages", schema=None) as batch_op:
+        batch_op.drop_index("ix_webpages_path")
+        batch_op.drop_column("path")
@@ -0,0 +1,133 @@
+"""Add indexes and unique constraints for lookups
+
+Revision ID: 9d3b72e1f4a6
+Revises: 5e8a41c7d2f9
+Create Date: 2026-10-17 19:02:45.118304
+
+"""
+
+from alembic import op
+from sqlalchemy.sql import text
+
+# revision identifiers, used by Alembic.
+revision = "9d3b72e1f4a6"
+down_revision = "5e8a41c7d2f9"
+branch_labels = None
+depends_on = None
+
+
+def merge_duplicates(conn, table, columns, references):
+    """
+    Keep the oldest of the rows of a table with the same values of columns,
+    pointing the references to the other rows to it, and delete them.
+    """
+    match = " AND ".join(
+        f"kept.{column} = duplicate.{column}" for column in columns
+    )
+    duplicates = f"""
+        SELECT duplicate.id FROM {table} AS duplicate
+        WHERE duplicate.id > (
+            SELECT MIN(kept.id) FROM {table} AS kept WHERE {match}
+        )
+    """
+    for reference_table, reference_column in references:
+        conn.execute(
+            text(f"""
+            UPDATE {reference_table}
+            SET {reference_column} = (
+                SELECT MIN(kept.id)
+                FROM {table} AS kept
+                JOIN {table} AS duplicate ON {match}
+                WHERE duplicate.id = {reference_table}.{reference_column}
+            )
+            WHERE {reference_column} IN ({duplicates});
+        """)
+        )
+    conn.execute(text(f"DELETE FROM {table} WHERE id IN ({duplicates});"))
+
+
+def upgrade():
+    # Remove the duplicates that would break the unique constraints
+    conn = op.get_bind()
+    merge_duplicates(conn, "projects", ["name"], [("webpages", "project_id")])
+    merge_duplicates(
+        conn,
+        "webpages",
+        ["project_id", "name"],
+        [
+            ("webpages", "parent_id"),
+            ("reviewers", "webpage_id"),
+            ("jira_tasks", "webpage_id"),
+        ],
+    )
+    merge_duplicates(
+        conn,
+        "users",
+        ["hrc_id"],
+        [
+            ("webpages", "owner_id"),
+            ("reviewers", "user_id"),
+            ("jira_tasks", "user_id"),
+        ],
+    )
+    # Set the paths of the webpages moved to merged parents
+    conn.execute(
+        text("""
+        WITH RECURSIVE tree (id, path) AS (
+            SELECT id, CAST('/' AS VARCHAR)
+            FROM webpages
+            WHERE parent_id IS NULL
+            UNION ALL
+            SELECT webpages.id,
+                CAST(tree.path || tree.id || '/' AS VARCHAR)
+            FROM webpages
+            JOIN tree ON webpages.parent_id = tree.id
+        )
+        UPDATE webpages
+        SET path = (SELECT tree.path FROM tree WHERE tree.id = webpages.id);
+    """)
+    )
+
+    with op.batch_alter_table("projects", schema=None) as batch_op:
+        batch_op.create_unique_constraint("uq_projects_name", ["name"])
+
+    with op.batch_alter_table("webpages", schema=None) as batch_op:
+        batch_op.create_unique_constraint(
+            "uq_webpages_project_id_name", ["project_id", "name"]
+        )
+        batch_op.create_index(
+            batch_op.f("ix_webpages_parent_id"), ["parent_id"], unique=False
+        )
+
+    with op.batch_alter_table("users", schema=None) as batch_op:
+        batch_op.create_unique_constraint("uq_users_hrc_id", ["hrc_id"])
+
+    with op.batch_alter_table("reviewers", schema=None) as batch_op:
+        batch_op.create_index(
+            batch_op.f("ix_reviewers_webpage_id"), ["webpage_id"], unique=False
+        )
+
+    with op.batch_alter_table("jira_tasks", schema=None) as batch_op:
+        batch_op.create_index(
+            batch_op.f("ix_jira_tasks_webpage_id"),
+            ["webpage_id"],
+            unique=False,
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("jira_tasks", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_jira_tasks_webpage_id"))
+
+    with op.batch_alter_table("reviewers", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_reviewers_webpage_id"))
+
+    with op.batch_alter_table("users", schema=None) as batch_op:
+        batch_op.drop_constraint("uq_users_hrc_id", type_="unique")
+
+    with op.batch_alter_table("webpages", schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f("ix_webpages_parent_id"))
+        batch_op.drop_constraint("uq_webpages_project_id_name", type_="unique")
+
+    with op.batch_alter_table("projects", schema=None) as batch_op:
+        batch_op.drop_constraint("uq_projects_name", type_="unique")
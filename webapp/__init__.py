@@ -9,6 +9,7 @@ from werkzeug.middleware.proxy_fix import ProxyFix
 from webapp.cache import init_cache
 from webapp.context import RegexConverter, base_context, clear_trailing_slash
 from webapp.gdrive import init_gdrive
+from webapp.instrumentation import init_instrumentation
 from webapp.jira import init_jira
 from webapp.models import init_db
 from webapp.sso import init_sso
@@ -254,6 +255,9 @@ class FlaskBase(flask.Flask):
         self.after_request(set_permissions_policy_headers)
         self.after_request(set_clacks)
 
+        # Count the queries run by each request
+        init_instrumentation(self)
+
         self.context_processor(base_context)
 
         # Default error handlers
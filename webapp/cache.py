@@ -1,7 +1,14 @@
+import contextlib
+import fcntl
+import hashlib
 import json
 import os
-import shutil
+import tempfile
+import threading
+import time
+import uuid
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 from pathlib import Path
 from typing import Any
 
@@ -11,7 +18,10 @@ from flask import Flask
 
 def init_cache(app: Flask):
     try:
-        cache = ValkeyCache(app)
+        if app.config["LOCAL_CACHE_SIZE"]:
+            cache = TieredCache(app)
+        else:
+            cache = ValkeyCache(app)
     except ConnectionError as e:
         cache = FileCache(app)
         app.logger.info(
@@ -45,11 +55,27 @@ class Cache(ABC):
         """Check if the cache is available"""
         pass
 
+    @abstractmethod
+    def lock(self, key: str, timeout: float):
+        """
+        Context manager that tries to take a lock shared by all processes
+        using the cache, without waiting, and yields whether it was taken.
+        The lock is released after timeout seconds if it wasn't before.
+        """
+        pass
+
 
 class ValkeyCache(Cache):
     """Cache interface"""
 
     CACHE_PREFIX = "WEBSITES-CONTENT-SYSTEM"
+    # Delete a lock only if it is still held by the same owner
+    RELEASE_LOCK_SCRIPT = """
+        if redis.call("get", KEYS[1]) == ARGV[1] then
+            return redis.call("del", KEYS[1])
+        end
+        return 0
+    """
 
     def __init__(self, app: Flask):
         self.host = app.config["VALKEY_HOST"]
@@ -109,6 +135,138 @@ class ValkeyCache(Cache):
         except Exception as e:
             raise e
 
+    @contextlib.contextmanager
+    def lock(self, key: str, timeout: float):
+        name = self.__get_prefixed_key__(f"{key}_LOCK")
+        token = uuid.uuid4().hex
+        acquired = self.instance.set(
+            name, token, nx=True, px=int(timeout * 1000)
+        )
+        try:
+            yield bool(acquired)
+        finally:
+            if acquired:
+                self.instance.eval(self.RELEASE_LOCK_SCRIPT, 1, name, token)
+
+
+class TieredCache(ValkeyCache):
+    """
+    Valkey cache with an in-process LRU cache in front of it, so that
+    repeated reads of a key don't go through the network and JSON.
+
+    Each key has a version in Valkey, incremented whenever it is set or
+    deleted, and the new version is published to all processes, which drop
+    their older copy of the key. Values are only kept in process while the
+    subscription is up, so that an invalidation can't be missed.
+
+    Values read from the process cache are shared, and must not be modified.
+    """
+
+    CHANNEL = f"{ValkeyCache.CACHE_PREFIX}_INVALIDATE"
+
+    def __init__(self, app: Flask):
+        super().__init__(app)
+        self.size = app.config["LOCAL_CACHE_SIZE"]
+        self.pid = None
+        self.__start__()
+
+    def __start__(self):
+        """
+        Clear the process cache, and start listening to invalidations
+        """
+        self.pid = os.getpid()
+        self.local_lock = threading.Lock()
+        # Cached values and their version, from least to most recently used
+        self.local = OrderedDict()
+        # Latest version of each key, published or read
+        self.versions = {}
+        self.listening = False
+        threading.Thread(target=self.__listen__, daemon=True).start()
+
+    def __listen__(self):
+        pid = self.pid
+        while pid == self.pid:
+            try:
+                pubsub = self.instance.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.CHANNEL)
+                with self.local_lock:
+                    # Values may have changed while not subscribed
+                    self.local.clear()
+                    self.listening = True
+                for message in pubsub.listen():
+                    if pid != self.pid:
+                        return
+                    data = json.loads(message["data"])
+                    self.__invalidate__(data["key"], data["version"])
+            except (
+                valkey.exceptions.ConnectionError,
+                valkey.exceptions.TimeoutError,
+            ) as e:
+                self.logger.error(f"Cache invalidations unavailable: {e}")
+            with self.local_lock:
+                self.listening = False
+                self.local.clear()
+            time.sleep(1)
+
+    def __invalidate__(self, key: str, version: int):
+        """
+        Drop the cached value of a key if it is older than version
+        """
+        with self.local_lock:
+            self.versions[key] = max(version, self.versions.get(key, 0))
+            if key in self.local and self.local[key][0] < version:
+                del self.local[key]
+
+    def __publish__(self, key: str, version: int):
+        self.__invalidate__(key, version)
+        self.instance.publish(
+            self.CHANNEL, json.dumps({"key": key, "version": version})
+        )
+
+    def __get_version_key__(self, key: str):
+        return f"{self.__get_prefixed_key__(key)}_VERSION"
+
+    def get(self, key: str):
+        # Processes forked from this one have to listen for themselves
+        if self.pid != os.getpid():
+            self.__start__()
+        with self.local_lock:
+            if self.listening and key in self.local:
+                self.local.move_to_end(key)
+                return self.local[key][1]
+
+        pipeline = self.instance.pipeline()
+        pipeline.get(self.__get_prefixed_key__(key))
+        pipeline.get(self.__get_version_key__(key))
+        value, version = pipeline.execute()
+        value = self.__deserialize__(value)
+        version = int(version or 0)
+
+        with self.local_lock:
+            # Don't keep values invalidated while they were read
+            if self.listening and version >= self.versions.get(key, 0):
+                self.local[key] = (version, value)
+                self.local.move_to_end(key)
+                while len(self.local) > self.size:
+                    self.local.popitem(last=False)
+        return value
+
+    def set(self, key: str, value: Any):
+        pipeline = self.instance.pipeline()
+        pipeline.set(self.__get_prefixed_key__(key), self.__serialize__(value))
+        pipeline.incr(self.__get_version_key__(key))
+        result, version = pipeline.execute()
+        self.__publish__(key, version)
+        return result
+
+    def delete(self, key: str):
+        pipeline = self.instance.pipeline()
+        pipeline.delete(self.__get_prefixed_key__(key))
+        pipeline.incr(self.__get_version_key__(key))
+        result, version = pipeline.execute()
+        self.__publish__(key, version)
+        return result
+
 
 class FileCacheError(Exception):
     """
@@ -117,13 +275,26 @@ class FileCacheError(Exception):
 
 
 class FileCache(Cache):
-    """Cache interface"""
+    """
+    Cache interface, storing values as JSON files.
+
+    Files are named by the SHA-256 of their key, sharded in directories by
+    the first two characters of the hash. They are written to a temporary
+    file and renamed, so readers never see a partial file. Once the files
+    are over the maximum size, the least recently used are removed.
+    """
 
     CACHE_DIR = "tree-cache"
     CACHE_PREFIX = "WEBSITES_CONTENT_SYSTEM"
+    LOCK_FILE = ".lock"
+    LOCK_SUFFIX = ".lock"
+    TEMP_SUFFIX = ".tmp"
+    # Temporary files older than this, in seconds, were left by a crash
+    TEMP_FILE_TIMEOUT = 3600
 
     def __init__(self, app: Flask):
         self.cache_path = app.config["BASE_DIR"] + "/" + self.CACHE_DIR
+        self.max_size = app.config["FILE_CACHE_MAX_SIZE"]
         self.logger = app.logger
         # Create directory
         Path(self.cache_path).mkdir(parents=True, exist_ok=True)
@@ -138,38 +309,105 @@ class FileCache(Cache):
         """
         self.logger.info(f"Connecting to FileCache at {self.cache_path}")
 
-        path_exists = Path(self.cache_path).exists()
         path_writable = Path(self.cache_path).is_dir() and os.access(
             self.cache_path, os.W_OK
         )
-        if not path_exists and path_writable:
+        if not path_writable:
             raise ConnectionError("Cache directory is not writable")
 
+    def get_file_path(self, key: str):
+        """
+        Return the path of the file of a key.
+        """
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return Path(self.cache_path) / digest[:2] / digest
+
     def save_to_file(self, key: str, value: Any):
         """
         Dump the python object to JSON and save it to a file.
         """
-        data = json.dumps(value)
-        # Delete the file if it exists
-        if Path(self.cache_path + "/" + key).exists():
-            os.remove(self.cache_path + "/" + key)
-        # Create base directory if it does not exist
-        if not Path(self.cache_path).exists():
-            Path(self.cache_path).mkdir(parents=True, exist_ok=True)
-        with open(self.cache_path + "/" + key, "w") as f:
-            f.write(data)
+        path = self.get_file_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(
+            suffix=self.TEMP_SUFFIX, dir=path.parent
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(value, f)
+            os.replace(temp_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temp_path)
+            raise
+        self.evict()
 
     def load_from_file(self, key: str):
         """
         Load the JSON data from a file and return the python object.
         """
-        # Check if the file exists
-        if not Path(self.cache_path + "/" + key).exists():
+        path = self.get_file_path(key)
+        try:
+            with open(path, "r") as f:
+                data = f.read()
+        except FileNotFoundError:
             return None
-        with open(self.cache_path + "/" + key, "r") as f:
-            data = f.read()
+        # Mark the file as recently used
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(path)
         return json.loads(data)
 
+    def evict(self):
+        """
+        Remove the least recently used files until the cache is under its
+        maximum size, along with the temporary files left by crashes. Only
+        one process evicts at a time, the others skip it.
+        """
+        with open(Path(self.cache_path) / self.LOCK_FILE, "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+
+            files = []
+            now = time.time()
+            for shard in os.scandir(self.cache_path):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    with contextlib.suppress(FileNotFoundError):
+                        stat = entry.stat()
+                        if entry.name.endswith(self.TEMP_SUFFIX):
+                            if now - stat.st_mtime > self.TEMP_FILE_TIMEOUT:
+                                os.remove(entry.path)
+                        elif not entry.name.endswith(self.LOCK_SUFFIX):
+                            files.append(
+                                (stat.st_mtime, stat.st_size, entry.path)
+                            )
+
+            size = sum(file_size for _, file_size, _ in files)
+            for _, file_size, path in sorted(files):
+                if size <= self.max_size:
+                    break
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                size -= file_size
+
+    @contextlib.contextmanager
+    def lock(self, key: str, timeout: float):
+        """
+        Lock a file next to the file of the key. The lock is released when
+        the file is closed, even if the process dies, so timeout is unused.
+        """
+        path = self.get_file_path(self.__get_prefixed_key__(key))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(f"{path}{self.LOCK_SUFFIX}", "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+
     def __get_prefixed_key__(self, key: str):
         return f"{self.CACHE_PREFIX}_{key}"
 
@@ -183,8 +421,5 @@ class FileCache(Cache):
         """
         Delete the file from the cache directory.
         """
-
-        def onerror(*args, **kwargs):
-            os.chmod(self.cache_path + "/" + key, 0o777)
-
-        return shutil.rmtree(self.cache_path + "/" + key, onerror=onerror)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.get_file_path(self.__get_prefixed_key__(key)))
@@ -1,6 +1,18 @@
-from webapp.models import JiraTask, User, Project, Webpage, db, get_or_create
+from webapp.models import (
+    JiraTask,
+    Reviewer,
+    User,
+    Project,
+    Webpage,
+    db,
+    get_or_create,
+)
+from webapp.serializers import TreeSerializer
 from enum import Enum
 
+from sqlalchemy import case, func, literal, select, update
+from sqlalchemy.orm import joinedload, subqueryload
+
 
 class RequestType(Enum):
     COPY_UPDATE = 0
@@ -81,92 +93,155 @@ def get_webpage_id(name, project_id):
     return webpage.id if webpage else None
 
 
-def convert_webpage_to_dict(webpage, owner, project):
-    # Preload relationships
-    webpage.reviewers
-    webpage.jira_tasks
-    webpage.owner
-    webpage.project
-
-    webpage_dict = webpage.__dict__.copy()
-
-    # Remove unnecessary fields
-    webpage_dict.pop("_sa_instance_state", None)
-    webpage_dict.pop("owner_id", None)
-    webpage_dict.pop("project_id", None)
-    owner = webpage_dict.pop("owner", None)
-    project = webpage_dict.pop("project", None)
-    reviewers = webpage_dict.pop("reviewers", None)
-    jira_tasks = webpage_dict.pop("jira_tasks", None)
-
-    # Serialize owner fields
-    if owner:
-        owner_dict = owner.__dict__.copy()
-        owner_dict["created_at"] = owner.created_at.isoformat()
-        owner_dict["updated_at"] = owner.updated_at.isoformat()
-        if owner_dict["_sa_instance_state"]:
-            owner_dict.pop("_sa_instance_state", None)
-    else:
-        owner_dict = {}
-
-    # Serialize project fields
-    if project:
-        project_dict = project.__dict__.copy()
-        project_dict["created_at"] = project.created_at.isoformat()
-        project_dict["updated_at"] = project.updated_at.isoformat()
-        if project_dict["_sa_instance_state"]:
-            project_dict.pop("_sa_instance_state", None)
-    else:
-        project_dict = {}
-
-    # Serialize reviewers fields
-    if reviewers:
-        reviewers_list = []
-        for reviewer in reviewers:
-            reviewer_dict = reviewer.__dict__.copy()
-            reviewer_dict.pop("_sa_instance_state", None)
-            reviewer_dict["created_at"] = reviewer.created_at.isoformat()
-            reviewer_dict["updated_at"] = reviewer.updated_at.isoformat()
-            # Expand the user object
-            reviewer_user_dict = reviewer.user.__dict__.copy()
-            reviewer_user_dict.pop("created_at")
-            reviewer_user_dict.pop("updated_at")
-            if reviewer_user_dict["_sa_instance_state"]:
-                reviewer_user_dict.pop("_sa_instance_state", None)
-            reviewer_dict = {**reviewer_dict, **reviewer_user_dict}
-            reviewers_list.append(reviewer_dict)
-    else:
-        reviewers_list = []
-
-    # Serialize jira_tasks fields
-    if jira_tasks:
-        jira_tasks_list = []
-        for jira_task in jira_tasks:
-            jira_task_dict = jira_task.__dict__.copy()
-            jira_task_dict.pop("_sa_instance_state", None)
-            jira_task_dict["created_at"] = jira_task.created_at.isoformat()
-            jira_task_dict["updated_at"] = jira_task.updated_at.isoformat()
-            # Expand the user object
-            jira_task_user_dict = jira_task.user.__dict__.copy()
-            jira_task_user_dict.pop("created_at")
-            jira_task_user_dict.pop("updated_at")
-            if jira_task_user_dict["_sa_instance_state"]:
-                jira_task_user_dict.pop("_sa_instance_state", None)
-            jira_task_dict = {**jira_task_dict, **jira_task_user_dict}
-            jira_tasks_list.append(jira_task_dict)
-    else:
-        jira_tasks_list = []
+def get_serialized_relationships():
+    """
+    Return the options loading the relationships of webpages that are
+    serialized with them.
+
+    Collections are loaded with subqueries rather than with IN lists of
+    webpage ids, which would take a query per batch of 500 webpages.
+    """
+    return (
+        joinedload(Webpage.owner),
+        joinedload(Webpage.project),
+        subqueryload(Webpage.reviewers).joinedload(Reviewer.user),
+        subqueryload(Webpage.jira_tasks).joinedload(JiraTask.user),
+    )
+
+
+def get_project_webpages(session, project_id):
+    """
+    Return the webpages of a project, along with the relationships that are
+    serialized with them, in a fixed number of queries.
+    """
+    return (
+        session.execute(
+            select(Webpage)
+            .where(Webpage.project_id == project_id)
+            .options(*get_serialized_relationships())
+        )
+        .scalars()
+        .all()
+    )
+
+
+def get_webpage(session, webpage_id):
+    """
+    Return a webpage, along with the relationships that are serialized with
+    it, or None if there is no such webpage.
+    """
+    return session.execute(
+        select(Webpage)
+        .where(Webpage.id == webpage_id)
+        .options(*get_serialized_relationships())
+    ).scalar_one_or_none()
+
+
+def get_descendants_path(webpage):
+    """
+    Return the path shared by the descendants of a webpage, the path of the
+    webpage followed by its id.
+    """
+    return f"{webpage.path}{webpage.id}/"
+
+
+def get_webpage_descendants(session, webpage):
+    """
+    Return the descendants of a webpage, in a single query on the path
+    index, ordered by depth.
+    """
+    return (
+        session.execute(
+            select(Webpage)
+            .where(
+                Webpage.project_id == webpage.project_id,
+                Webpage.path.startswith(get_descendants_path(webpage)),
+            )
+            .order_by(func.length(Webpage.path), Webpage.name)
+        )
+        .scalars()
+        .all()
+    )
+
+
+def get_webpage_ancestors(session, webpage):
+    """
+    Return the ancestors of a webpage, from the root, in a single query on
+    the ids in its path.
+    """
+    ids = [int(id) for id in webpage.path.strip("/").split("/") if id]
+    ancestors = {
+        ancestor.id: ancestor
+        for ancestor in session.execute(
+            select(Webpage).where(Webpage.id.in_(ids))
+        ).scalars()
+    }
+    return [ancestors[id] for id in ids if id in ancestors]
+
+
+def get_webpage_breadcrumbs(session, webpage):
+    """
+    Return the name and title of the ancestors of a webpage, from the root,
+    followed by the webpage itself.
+    """
+    return [
+        {"id": page.id, "name": page.name, "title": page.title}
+        for page in [*get_webpage_ancestors(session, webpage), webpage]
+    ]
+
+
+def move_webpage(session, webpage, parent, name=None):
+    """
+    Move a webpage and its descendants under a new parent, and rename them
+    if a new name is given, in a single UPDATE statement.
 
-    # Serialize object fields
-    webpage_dict["status"] = webpage.status.value
-    webpage_dict["created_at"] = webpage.created_at.isoformat()
-    webpage_dict["updated_at"] = webpage.updated_at.isoformat()
-    webpage_dict["owner"] = owner_dict
-    webpage_dict["project"] = project_dict
-    webpage_dict["reviewers"] = reviewers_list
-    webpage_dict["jira_tasks"] = jira_tasks_list
+    The path of each webpage in the subtree starts with the path of the
+    webpage, which is replaced by its new path. Names are renamed the same
+    way, so that "/server/maas" becomes "/cloud/maas" when "/server" is
+    renamed to "/cloud".
+    """
+    descendants_path = get_descendants_path(webpage)
+    new_path = get_descendants_path(parent) if parent else "/"
+    if new_path.startswith(descendants_path):
+        raise ValueError(
+            f"Cannot move {webpage.name} under itself or its descendants"
+        )
+
+    values = {
+        "path": literal(new_path)
+        + func.substr(Webpage.path, len(webpage.path) + 1),
+        "parent_id": case(
+            (Webpage.id == webpage.id, parent.id if parent else None),
+            else_=Webpage.parent_id,
+        ),
+    }
+    if name is not None:
+        new_name = literal(name) + func.substr(
+            Webpage.name, len(webpage.name) + 1
+        )
+        values["name"] = new_name
+        values["url"] = case(
+            (Webpage.url == Webpage.name, new_name), else_=Webpage.url
+        )
 
-    return webpage_dict
+    session.execute(
+        update(Webpage)
+        .where(
+            Webpage.project_id == webpage.project_id,
+            (Webpage.id == webpage.id)
+            | Webpage.path.startswith(descendants_path),
+        )
+        .values(values)
+        .execution_options(synchronize_session="fetch")
+    )
+
+
+def convert_webpage_to_dict(webpage, owner, project, serializer=None):
+    """
+    Serialize a webpage, along with its owner, project, reviewers and jira
+    tasks. Pass a serializer to reuse the owners and projects it serialized.
+    """
+    return (serializer or TreeSerializer()).serialize_webpage(webpage)
 
 
 def create_copy_doc(app, webpage):
@@ -175,16 +250,21 @@ def create_copy_doc(app, webpage):
     return f"https://docs.google.com/document/d/{task['id']}" if task else None
 
 
-# recursively build tree from webpages table rows
-def build_tree(session, page, webpages):
-    child_pages = list(filter(lambda p: p.parent_id == page["id"], webpages))
-    for child_page in child_pages:
-        project = get_or_create(session, Project, id=child_page.project_id)
-        owner = get_or_create(session, User, id=child_page.owner_id)
-        new_child = convert_webpage_to_dict(child_page, owner, project)
-        new_child["children"] = []
-        page["children"].append(new_child)
-        build_tree(session, new_child, webpages)
+def build_tree(page, children, serializer):
+    """
+    Add the descendants of a page to it, from an index of the child pages
+    of each page id.
+    """
+    pages = [page]
+    while pages:
+        page = pages.pop()
+        for child_page in children.get(page["id"], []):
+            new_child = convert_webpage_to_dict(
+                child_page, child_page.owner, child_page.project, serializer
+            )
+            new_child["children"] = []
+            page["children"].append(new_child)
+            pages.append(new_child)
 
 
 def get_tree_struct(session, webpages):
@@ -192,16 +272,118 @@ def get_tree_struct(session, webpages):
     webpages_list = sorted(
         list(webpages), key=lambda p: p.name.rsplit("/", 1)[-1]
     )
-    parent_page = next(
-        filter(lambda p: p.parent_id is None, webpages_list), None
-    )
 
-    if parent_page:
-        project = get_or_create(session, Project, id=parent_page.project_id)
-        owner = get_or_create(session, User, id=parent_page.owner_id)
-        tree = convert_webpage_to_dict(parent_page, owner, project)
+    # Index the child pages of each page, keeping them sorted
+    children = {}
+    for page in webpages_list:
+        children.setdefault(page.parent_id, []).append(page)
+
+    if parent_pages := children.get(None):
+        parent_page = parent_pages[0]
+        serializer = TreeSerializer()
+        tree = convert_webpage_to_dict(
+            parent_page, parent_page.owner, parent_page.project, serializer
+        )
         tree["children"] = []
-        build_tree(session, tree, webpages_list)
+        build_tree(tree, children, serializer)
         return tree
 
     return None
+
+
+def find_tree_node(tree, path):
+    """
+    Return the node of the tree for the page at path, or None if there is
+    no such page.
+
+    Page names are paths, so the node is looked up by following the
+    children whose name is a prefix of the path, and the whole tree is only
+    searched if that fails.
+    """
+    path = path.rstrip("/")
+    node = tree
+    while node:
+        if node["name"] == path:
+            return node
+        node = next(
+            (
+                child
+                for child in node.get("children", [])
+                if path == child["name"]
+                or path.startswith(child["name"] + "/")
+            ),
+            None,
+        )
+
+    nodes = [tree]
+    while nodes:
+        node = nodes.pop()
+        if node["name"] == path:
+            return node
+        nodes.extend(node.get("children", []))
+    return None
+
+
+def get_tree_view(node, depth=None, fields=None):
+    """
+    Return a copy of a tree node, leaving out the nodes deeper than depth
+    levels below it, and the fields that are not in fields.
+
+    Nodes whose children are left out have an empty list of children, and
+    the number of their children in children_count. The tree itself is not
+    modified, so it can be served from the cache.
+    """
+    view = {
+        key: value
+        for key, value in node.items()
+        if key != "children" and (fields is None or key in fields)
+    }
+    children = node.get("children", [])
+    if depth is not None and depth <= 0:
+        view["children"] = []
+        view["children_count"] = len(children)
+    else:
+        view["children"] = [
+            get_tree_view(child, None if depth is None else depth - 1, fields)
+            for child in children
+        ]
+    return view
+
+
+def get_tree_index(tree):
+    """
+    Return the position of the node of each webpage in the tree, keyed by
+    webpage id. Positions are the indexes of the children leading to the
+    node from the root.
+    """
+    index = {}
+    nodes = [(tree, [])]
+    while nodes:
+        node, position = nodes.pop()
+        if "id" in node:
+            index[str(node["id"])] = position
+        nodes.extend(
+            (child, [*position, child_index])
+            for child_index, child in enumerate(node.get("children", []))
+        )
+    return index
+
+
+def replace_tree_node(tree, position, fields=None):
+    """
+    Return a copy of the tree with the fields of the node at position
+    updated, or with the node removed if fields is None.
+
+    Only the nodes leading to the node are copied, so the tree itself isn't
+    modified, and can be shared with the cache.
+    """
+    tree = dict(tree)
+    node = tree
+    for depth, child_index in enumerate(position):
+        node["children"] = children = list(node["children"])
+        if fields is None and depth == len(position) - 1:
+            del children[child_index]
+            return tree
+        node = children[child_index] = dict(children[child_index])
+    node.update(fields)
+    return tree
@@ -0,0 +1,130 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging import Logger
+
+import flask
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Statistics of the queries run by the current request or task
+QUERY_STATS: ContextVar = ContextVar("query_stats", default=None)
+
+
+class QueryStats:
+    """
+    Number of statements run, and the time spent running them, by a request
+    or a task.
+    """
+
+    __slots__ = ("name", "logger", "slow_query_threshold", "count", "duration")
+
+    def __init__(self, name: str, logger: Logger, slow_query_threshold: float):
+        self.name = name
+        self.logger = logger
+        # Statements running for longer than this, in seconds, are logged
+        self.slow_query_threshold = slow_query_threshold
+        self.count = 0
+        self.duration = 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.count} queries in {self.duration * 1000:.1f}ms "
+            f"for {self.name}"
+        )
+
+
+def before_cursor_execute(conn, cursor, statement, *args):
+    if QUERY_STATS.get() is not None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, *args):
+    stats = QUERY_STATS.get()
+    # Statements may have started before the stats were set
+    if stats is None or not conn.info.get("query_start"):
+        return
+    duration = time.perf_counter() - conn.info["query_start"].pop()
+    stats.count += 1
+    stats.duration += duration
+    if duration > stats.slow_query_threshold:
+        stats.logger.warning(
+            f"Slow query ({duration * 1000:.1f}ms) for {stats.name}: "
+            f"{statement}"
+        )
+
+
+def handle_error(context):
+    # Failed statements don't reach after_cursor_execute
+    if context.connection is not None:
+        if starts := context.connection.info.get("query_start"):
+            starts.pop()
+
+
+@contextmanager
+def track_queries(app: flask.Flask, name: str):
+    """
+    Count the statements run in this context, and the time spent running
+    them. Statements run by other threads aren't counted.
+    """
+    stats = QueryStats(
+        name, app.logger, app.config["SLOW_QUERY_THRESHOLD"] / 1000
+    )
+    token = QUERY_STATS.set(stats)
+    try:
+        yield stats
+    finally:
+        QUERY_STATS.reset(token)
+
+
+def start_request_stats():
+    """
+    Track the queries run by the request
+    """
+    app = flask.current_app
+    stats = QueryStats(
+        f"{flask.request.method} {flask.request.path}",
+        app.logger,
+        app.config["SLOW_QUERY_THRESHOLD"] / 1000,
+    )
+    flask.g.query_stats = stats
+    flask.g.query_stats_token = QUERY_STATS.set(stats)
+
+
+def add_server_timing_header(response):
+    """
+    Log the queries run by the request, and add them to the Server-Timing
+    header if enabled
+    """
+    stats = flask.g.get("query_stats")
+    if stats is None:
+        return response
+    flask.current_app.logger.debug(stats)
+    if flask.current_app.config.get("SERVER_TIMING"):
+        response.headers.add(
+            "Server-Timing",
+            f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries"',
+        )
+    return response
+
+
+def stop_request_stats(error=None):
+    if token := flask.g.pop("query_stats_token", None):
+        QUERY_STATS.reset(token)
+
+
+def init_instrumentation(app: flask.Flask):
+    """
+    Track the queries run by each request. The engine events are set once
+    for all engines, and do nothing outside of tracked requests and tasks.
+    """
+    if not event.contains(
+        Engine, "before_cursor_execute", before_cursor_execute
+    ):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+        event.listen(Engine, "handle_error", handle_error)
+
+    app.before_request(start_request_stats)
+    app.after_request(add_server_timing_header)
+    app.teardown_request(stop_request_stats)
@@ -4,7 +4,20 @@ from datetime import datetime, timezone
 from flask import Flask
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, DateTime, Enum, ForeignKey, Integer, String
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Enum,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    UniqueConstraint,
+    bindparam,
+    insert,
+    update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import DeclarativeBase, Mapped, relationship
 from sqlalchemy.orm.session import Session
 
@@ -13,6 +26,15 @@ class Base(DeclarativeBase):
     pass
 
 
+# Dialects that support INSERT ... ON CONFLICT, with their insert construct
+CONFLICT_DIALECTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+# Maximum number of rows written by a single statement
+BATCH_SIZE = 1000
+
+
 db = SQLAlchemy(model_class=Base, engine_options={"poolclass": None})
 
 
@@ -40,6 +62,78 @@ def get_or_create(session: Session, model: Base, commit=True, **kwargs):
         return instance, True
 
 
+def bulk_insert(
+    session: Session,
+    model: Base,
+    rows: list[dict],
+    key: str = "id",
+    unique: list[str] = None,
+):
+    """
+    Insert rows in batched multi-row INSERT statements, and return the ids
+    of the new rows.
+
+    :param session: The database session to insert the rows with.
+    :param model: The model class of the rows.
+    :param rows: The column values of each row. All rows must have the same
+        columns.
+    :param key: A column whose values are unique among the rows.
+    :param unique: The columns of a unique constraint. Rows conflicting
+        with existing rows on them, e.g. inserted concurrently, are skipped
+        on PostgreSQL and SQLite, and left out of the returned ids.
+    :return: The ids of the inserted rows, keyed by their value of key.
+    """
+    if not rows:
+        return {}
+    table = model.__table__
+    dialect = session.get_bind().dialect.name
+    if unique and dialect in CONFLICT_DIALECTS:
+        statement = CONFLICT_DIALECTS[dialect](table).on_conflict_do_nothing(
+            index_elements=[table.c[column] for column in unique]
+        )
+    else:
+        statement = insert(table)
+    # Rows are matched to their ids by key, as databases may return the
+    # ids of a multi-row INSERT in any order
+    statement = statement.returning(table.c[key], table.c.id)
+    return dict(session.execute(statement, rows).all())
+
+
+def bulk_update(
+    session: Session, model: Base, rows: list[dict], columns: list[str]
+):
+    """
+    Update rows by id, in a single executemany UPDATE statement. Rows that
+    don't exist anymore, e.g. deleted while the values were computed, are
+    left deleted.
+
+    :param session: The database session to update the rows with.
+    :param model: The model class of the rows.
+    :param rows: The column values of each row, including its id. All rows
+        must have the same columns.
+    :param columns: The columns to update.
+    """
+    if not rows:
+        return
+    table = model.__table__
+    # A Core statement, as ORM updates by id fail on missing rows
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .values({column: bindparam(column) for column in columns})
+    )
+    session.execute(
+        statement,
+        [
+            {
+                "row_id": row["id"],
+                **{column: row[column] for column in columns},
+            }
+            for row in rows
+        ],
+    )
+
+
 class DateTimeMixin(object):
     created_at: Mapped[datetime] = Column(
         DateTime, default=datetime.now(timezone.utc), nullable=False
@@ -65,6 +159,8 @@ class Project(db.Model, DateTimeMixin):
     name: str = Column(String, nullable=False)
     webpages = relationship("Webpage", back_populates="project")
 
+    __table_args__ = (UniqueConstraint("name", name="uq_projects_name"),)
+
 
 class Webpage(db.Model, DateTimeMixin):
     __tablename__ = "webpages"
@@ -76,10 +172,26 @@ class Webpage(db.Model, DateTimeMixin):
     title: str = Column(String)
     description: str = Column(String)
     copy_doc_link: str = Column(String)
-    parent_id: int = Column(Integer, ForeignKey("webpages.id"))
+    parent_id: int = Column(Integer, ForeignKey("webpages.id"), index=True)
+    # Ids of the ancestors of the webpage, from the root, e.g. "/1/5/"
+    path: str = Column(String, default="/")
     owner_id: int = Column(Integer, ForeignKey("users.id"))
     status: str = Column(Enum(WebpageStatus), default=WebpageStatus.AVAILABLE)
 
+    __table_args__ = (
+        # Also indexes the webpages of each project
+        UniqueConstraint(
+            "project_id", "name", name="uq_webpages_project_id_name"
+        ),
+        # Index paths for prefix queries, whatever the collation of the
+        # database
+        Index(
+            "ix_webpages_path",
+            "path",
+            postgresql_ops={"path": "varchar_pattern_ops"},
+        ),
+    )
+
     project = relationship("Project", back_populates="webpages")
     owner = relationship("User", back_populates="webpages")
     reviewers = relationship("Reviewer", back_populates="webpages")
@@ -98,6 +210,8 @@ class User(db.Model, DateTimeMixin):
     hrc_id: int = Column(Integer)
     job_title: str = Column(String)
 
+    __table_args__ = (UniqueConstraint("hrc_id", name="uq_users_hrc_id"),)
+
     webpages = relationship("Webpage", back_populates="owner")
     reviewers = relationship("Reviewer", back_populates="user")
     jira_tasks = relationship("JiraTask", back_populates="user")
@@ -108,7 +222,7 @@ class Reviewer(db.Model, DateTimeMixin):
 
     id: int = Column(Integer, primary_key=True)
     user_id: int = Column(Integer, ForeignKey("users.id"))
-    webpage_id: int = Column(Integer, ForeignKey("webpages.id"))
+    webpage_id: int = Column(Integer, ForeignKey("webpages.id"), index=True)
 
     user = relationship("User", back_populates="reviewers")
     webpages = relationship("Webpage", back_populates="reviewers")
@@ -129,7 +243,7 @@ class JiraTask(db.Model, DateTimeMixin):
 
     id: int = Column(Integer, primary_key=True)
     jira_id: str = Column(String)
-    webpage_id: int = Column(Integer, ForeignKey("webpages.id"))
+    webpage_id: int = Column(Integer, ForeignKey("webpages.id"), index=True)
     user_id: int = Column(Integer, ForeignKey("users.id"))
     status: str = Column(String, default=JIRATaskStatus.TRIAGED)
     summary: str = Column(String)
@@ -1,5 +1,9 @@
+import multiprocessing
+import os
 import re
 from contextlib import suppress
+from concurrent.futures import Future, ProcessPoolExecutor
+from io import StringIO
 from pathlib import Path
 
 BASE_TEMPLATES = [
@@ -14,16 +18,22 @@ TAG_MAPPING = {
     "description": ["meta_description", "description"],
     "link": ["meta_copydoc"],
 }
+BLOCK_START_PATTERN = re.compile(
+    "{{% block ({0})( *)%}}".format(
+        "|".join(v for variants in TAG_MAPPING.values() for v in variants)
+    )
+)
+BLOCK_END_PATTERN = re.compile("{%( *)endblock")
+EXTENDS_PATTERN = re.compile("{% extends [\"'](.*?)[\"'] %}")
+COPYDOC_PATTERN = re.compile(
+    r"\{\% block meta_copydoc *\%\}(.*)\{\%( *)endblock"
+)
 
 
 def is_index(path):
     return path.name == "index.html"
 
 
-def check_has_index(path):
-    return (path / "index.html").exists()
-
-
 def is_template(path):
     """
     Return True if the file name starts with a template prefix.
@@ -38,45 +48,9 @@ def is_template(path):
     return False
 
 
-def append_base_path(base, path_name):
-    """
-    Add the base (root) to a path URI.
-
-    In some cases, e.g with server/maas/thank-you.html, the file refers
-    to a path
-
-    """
-    if str(path_name).startswith("/"):
-        path_name = path_name[1:]
-
-    new_path = Path(base) / path_name
-    return new_path.absolute()
-
-
-def extends_base(path, base="templates"):
+def extends_base(path, graph):
     """Return true if path extends templates/base.html"""
-    # TODO: Investigate whether path.read_text performs better than opening
-    # a file
-    with suppress(FileNotFoundError):
-        with path.open("r") as f:
-            for line in f.readlines():
-                match = re.search("{% extends [\"'](.*?)[\"'] %}", line)
-                if match:
-                    if match.group(1) in BASE_TEMPLATES:
-                        return True
-                    else:
-                        # extract absolute path from the parent path
-                        absolute_path = str(path)[
-                            0 : str(path).find(base) + len(base)
-                        ]
-                        # check if the file from which the current file
-                        # extends extends from the base template
-                        new_path = append_base_path(
-                            absolute_path, match.group(1)
-                        )
-                        return extends_base(new_path, base=base)
-
-    return False
+    return graph.extends_base(path)
 
 
 def resolve_if_tag(text):
@@ -116,79 +90,80 @@ def extract_text_from_tag(tag, data):
     return data
 
 
-def get_extended_copydoc(path, base):
+def get_extended_copydoc(path, graph):
     """
     Get the copydoc for the extended file
     """
-    if str(path).startswith("/"):
-        path = path[1:]
-    with base.joinpath(path).open("r") as f:
-        file_data = f.read()
-        if match := re.search(
-            "\{\% block meta_copydoc *\%\}(.*)\{\%( *)endblock", file_data
-        ):
-            return match.group(1)
+    return graph.get_copydoc(path)
 
 
-def get_tags_rolling_buffer(path):
+def extract_blocks(lines):
     """
-    Parse an html file and return a dictionary of its tags
+    Collect the raw contents of every tag block in a single pass over the
+    lines of a template.
+
+    Each block is buffered from its opening tag up to the line holding the
+    first "endblock" that follows it. Reading stops as soon as the preferred
+    variant of every tag has been found.
+    """
+    blocks = {}
+    buffers = {}
+    preferred = [variants[0] for variants in TAG_MAPPING.values()]
+
+    for line in lines:
+        # Add the line to the blocks that are still open
+        for buffer in buffers.values():
+            buffer.append(line)
+
+        if "{% block " in line:
+            for match in BLOCK_START_PATTERN.finditer(line):
+                variant = match.group(1)
+                if variant not in blocks and variant not in buffers:
+                    # We remove line contents before the tag
+                    buffers[variant] = [line[match.start() :]]  # noqa: E203
+
+        if buffers and "endblock" in line:
+            for variant, buffer in list(buffers.items()):
+                # Blocks can only close on the line that was just added
+                if BLOCK_END_PATTERN.search(buffer[-1]):
+                    blocks[variant] = "".join(buffer)
+                    del buffers[variant]
+
+        if all(variant in blocks for variant in preferred):
+            break
+
+    return blocks
+
+
+def get_tags_from_lines(lines):
+    """
+    Return the text of each tag defined in the lines of a template
     """
+    blocks = extract_blocks(lines)
+    tags = {tag: None for tag in TAG_MAPPING}
+
+    # Use the first variant of each tag that is defined in the file
+    for tag, variants in TAG_MAPPING.items():
+        for variant in variants:
+            if variant in blocks:
+                # We extract the text within the tags
+                tags[tag] = extract_text_from_tag(variant, blocks[variant])
+                break
+
+    return tags
+
 
+def get_tags_rolling_buffer(path, graph=None):
+    """
+    Parse an html file and return a dictionary of its tags
+    """
     tags = create_node()
-    available_tags = list(TAG_MAPPING.keys())
-
-    # We create a map of the selected variants for each tag
-    variants_mapping = {v: "" for v in available_tags}
-
-    with path.open("r") as f:
-        for tag in available_tags:
-            buffer = []
-            is_buffering = False
-            tag_found = False
-
-            variants = TAG_MAPPING[tag]
-
-            for variant in variants:
-                is_buffering = False
-                # Return to start of file
-                f.seek(0)
-
-                for line in f.readlines():
-                    if is_buffering:
-                        buffer.append(line)
-
-                    if not is_buffering and (
-                        match := re.search(f"{{% block {variant}( *)%}}", line)
-                    ):
-                        # We remove line contents before the tag
-                        line = line[match.start() :]  # noqa: E203
-
-                        buffer.append(line)
-                        is_buffering = True
-                        variants_mapping[tag] = variant
-
-                    # We search for the end of the tag in the existing buffer
-                    buffer_string = "".join(buffer)
-                    if is_buffering and re.search(
-                        "(.*){%( *)endblock", buffer_string
-                    ):
-                        # We save the buffer contents to the tags dictionary
-                        tags[tag] = buffer_string
-
-                        # We extract the text within the tags
-                        tags[tag] = extract_text_from_tag(
-                            variants_mapping[tag], tags[tag]
-                        )
-
-                        # We now reset the buffer
-                        buffer = []
-                        is_buffering = False
-                        tag_found = True
-                        break
-
-                if tag_found:
-                    break
+
+    if graph:
+        tags.update(graph.get_template(path)["tags"])
+    else:
+        with path.open("r") as f:
+            tags.update(get_tags_from_lines(f))
 
     # We add the name from the path
     raw_name = re.sub(r"(?i)(.html|/index.html)", "", str(path))
@@ -197,7 +172,7 @@ def get_tags_rolling_buffer(path):
     return tags
 
 
-def is_valid_page(path, extended_path, is_index=True):
+def is_valid_page(path, extended_path, graph, is_index=True):
     """
     Determine if path is a valid page. Pages are valid if:
     - They contain the same extended path as the index html.
@@ -207,23 +182,173 @@ def is_valid_page(path, extended_path, is_index=True):
         return False
 
     if not is_index and extended_path:
-        with path.open("r") as f:
-            for line in f.readlines():
-                if match := re.search("{% extends [\"'](.*?)[\"'] %}", line):
-                    if match.group(1) == extended_path:
-                        return True
+        if graph.get_extended_path(path) == extended_path:
+            return True
     # If the file does not share the extended path, check if it extends the
     # base html
-    return extends_base(path)
+    return extends_base(path, graph)
 
 
-def get_extended_path(path):
+def get_extended_path(path, graph):
     """Get the path extended by the file"""
-    with path.open("r") as f:
-        for line in f.readlines():
-            # TODO: also match single quotes \'
-            if match := re.search("{% extends [\"'](.*?)[\"'] %}", line):
-                return match.group(1)
+    return graph.get_extended_path(path)
+
+
+class TemplateGraph:
+    """
+    Inheritance graph of the templates in a site, built once per scan.
+
+    Templates are read the first time they are needed, and only once. The
+    path each template extends and the tags it defines are kept, along with
+    whether its chain of extended templates reaches one of BASE_TEMPLATES.
+
+    Templates can also be looked up in an index of earlier parse results,
+    keyed by git blob SHA. In that case, blobs maps the path of each
+    template, relative to the scan root, to its blob SHA.
+    """
+
+    def __init__(self, base, index=None, blobs=None):
+        self.base = Path(base).absolute()
+        self.index = index or {}
+        self.blobs = blobs or {}
+        # Parsed templates, keyed by absolute path
+        self.templates = {}
+        # Whether a template extends the base html, keyed by absolute path
+        self.extends_base_cache = {}
+
+    def get_relative_path(self, path):
+        """
+        Return the path of a template relative to the scan root.
+        """
+        return str(Path(path).relative_to(self.base))
+
+    def resolve(self, extended_path):
+        """
+        Return the file referred to by the path in an extends tag.
+
+        In some cases, e.g with server/maas/thank-you.html, the file refers
+        to a path from the root.
+        """
+        if extended_path.startswith("/"):
+            extended_path = extended_path[1:]
+        return self.base / extended_path
+
+    def parse_template(self, path):
+        """
+        Read a template and return the path it extends, its tags, and the
+        copydoc link it defines for the pages extending it.
+        """
+        try:
+            with path.open("r") as f:
+                file_data = f.read()
+        except FileNotFoundError:
+            return {
+                "extends": None,
+                "tags": get_tags_from_lines([]),
+                "copydoc": None,
+            }
+
+        match = EXTENDS_PATTERN.search(file_data)
+        copydoc = COPYDOC_PATTERN.search(file_data)
+        return {
+            "extends": match.group(1) if match else None,
+            "tags": get_tags_from_lines(StringIO(file_data)),
+            "copydoc": copydoc.group(1) if copydoc else None,
+        }
+
+    def get_template(self, path):
+        """
+        Return the parsed template, reading it if it hasn't been yet and its
+        blob is not in the index.
+        """
+        key = str(path)
+        if key not in self.templates:
+            blob = None
+            if self.blobs:
+                with suppress(ValueError):
+                    blob = self.blobs.get(self.get_relative_path(path))
+            if blob in self.index:
+                self.templates[key] = self.index[blob]
+            else:
+                self.templates[key] = self.parse_template(path)
+        return self.templates[key]
+
+    def get_index_entries(self):
+        """
+        Return the parsed templates that have a blob SHA, keyed by SHA.
+        """
+        entries = {}
+        for key, template in self.templates.items():
+            with suppress(ValueError):
+                if blob := self.blobs.get(self.get_relative_path(key)):
+                    entries[blob] = template
+        return entries
+
+    def get_extended_path(self, path):
+        """Get the path extended by the template"""
+        return self.get_template(path)["extends"]
+
+    def extends_base(self, path):
+        """
+        Return True if the chain of templates extended by path reaches one
+        of the BASE_TEMPLATES.
+        """
+        key = str(path)
+        if key in self.extends_base_cache:
+            return self.extends_base_cache[key]
+
+        # Templates in the chain being resolved count as not extending the
+        # base, so that inheritance cycles terminate
+        self.extends_base_cache[key] = False
+
+        extended_path = self.get_extended_path(path)
+        if extended_path is None:
+            result = False
+        elif extended_path in BASE_TEMPLATES:
+            result = True
+        else:
+            # Check if the file from which the current file extends, extends
+            # from the base template
+            result = self.extends_base(self.resolve(extended_path))
+
+        self.extends_base_cache[key] = result
+        return result
+
+    def get_copydoc(self, extended_path):
+        """
+        Return the copydoc link defined in an extended template, from the
+        template parsed once per scan however many pages take their link
+        from it.
+        """
+        path = self.resolve(extended_path)
+        template = self.get_template(path)
+        # Templates indexed before copydoc links were parsed are read again
+        if "copydoc" not in template:
+            template = self.templates[str(path)] = self.parse_template(path)
+        return template["copydoc"]
+
+    def get_dependencies(self):
+        """
+        Return the template extended by each parsed template, as paths
+        relative to the scan root.
+
+        The contents of BASE_TEMPLATES only matter to the pages that take
+        their copydoc from them, so only index pages depend on them.
+        """
+        dependencies = {}
+        for key, template in self.templates.items():
+            extended_path = template["extends"]
+            if not extended_path:
+                continue
+            if extended_path in BASE_TEMPLATES and not key.endswith(
+                "/index.html"
+            ):
+                continue
+            with suppress(ValueError):
+                dependencies[self.get_relative_path(key)] = (
+                    self.get_relative_path(self.resolve(extended_path))
+                )
+        return dependencies
 
 
 def update_tags(tags, new_tags):
@@ -247,17 +372,32 @@ def create_node():
     }
 
 
-def scan_directory(path_name, base=None):
+def is_empty_node(node):
+    """Return True if a directory node has no page and no children"""
+    return not (node.get("title") or node.get("children"))
+
+
+def scan_directory(path_name, base=None, graph=None, executor=None):
     """
-    We scan a given directory for valid pages and return a tree
+    We scan a given directory for valid pages and return a tree.
+
+    The directory is listed once, and the type of each entry is taken from
+    the listing, so that no further stat calls are needed.
+
+    If an executor is given, the subdirectories of this directory are
+    scanned in it, and merged back in the order they were found.
     """
-    node_path = Path(path_name)
     node = create_node()
     node["name"] = path_name.split("/templates", 1)[-1]
 
+    # The inheritance graph is shared by all directories in a scan
+    if graph is None:
+        graph = TemplateGraph(base or path_name)
     # We get the relative parent for the path
-    if base is None:
-        base = node_path.absolute()
+    base = graph.base
+
+    with os.scandir(path_name) as entries:
+        entries = list(entries)
 
     # This will be the base html file extended by the index.html
     extended_path = None
@@ -265,37 +405,211 @@ def scan_directory(path_name, base=None):
     is_index_page_valid = False
 
     # Check if an index.html file exists in this directory
-    has_index = check_has_index(node_path)
+    has_index = any(is_index(entry) for entry in entries)
     if has_index:
-        index_path = node_path / "index.html"
+        index_path = Path(path_name, "index.html")
         # Get the path extended by the index.html file
-        extended_path = get_extended_path(index_path)
+        extended_path = get_extended_path(index_path, graph)
         # If the file is valid, add it as a child
-        is_index_page_valid = is_valid_page(index_path, extended_path)
+        is_index_page_valid = is_valid_page(index_path, extended_path, graph)
         if is_index_page_valid:
             # Get tags, add as child
-            tags = get_tags_rolling_buffer(index_path)
+            tags = get_tags_rolling_buffer(index_path, graph)
             node = update_tags(node, tags)
 
     # Cycle through other files in this directory
-    for child in node_path.iterdir():
+    for entry in entries:
+        # If the child is a directory, scan it
+        if entry.is_dir():
+            if executor:
+                # Keep the pending scan in place to preserve the order
+                node["children"].append(
+                    executor.submit(scan_subdirectory, entry.path, base)
+                )
+                continue
+            child_node = scan_directory(entry.path, base=base, graph=graph)
+            if not is_empty_node(child_node):
+                node["children"].append(child_node)
         # If the child is a file, check if it is a valid page
-        if child.is_file() and not is_index(child):
+        elif entry.is_file() and not is_index(entry):
+            # Pages are only valid if the index page is
+            if has_index and not is_index_page_valid:
+                continue
+            child = Path(entry.path)
             # If the file is valid, add it as a child
-            if (not has_index or is_index_page_valid) and is_valid_page(
-                child, extended_path, is_index=False
-            ):
-                child_tags = get_tags_rolling_buffer(child)
+            if is_valid_page(child, extended_path, graph, is_index=False):
+                child_tags = get_tags_rolling_buffer(child, graph)
                 # If the child has no copydocs link, use the parent's link
                 if not child_tags.get("link") and extended_path:
                     child_tags["link"] = get_extended_copydoc(
-                        extended_path, base=base
+                        extended_path, graph
                     )
                 node["children"].append(child_tags)
-        # If the child is a directory, scan it
-        if child.is_dir():
-            child_node = scan_directory(str(child), base=base)
-            if child_node.get("title") or child_node.get("children"):
-                node["children"].append(child_node)
 
+    if executor:
+        children = []
+        for child in node["children"]:
+            if isinstance(child, Future):
+                child, templates = child.result()
+                graph.templates.update(templates)
+                if is_empty_node(child):
+                    continue
+            children.append(child)
+        node["children"] = children
+
+    return node
+
+
+# Template index and blobs used by the graphs of worker processes
+worker_graph_options = {}
+
+
+def init_worker(index, blobs):
+    """
+    Share the template index and blobs with a worker process, once.
+    """
+    worker_graph_options.update(index=index, blobs=blobs)
+
+
+def scan_subdirectory(path_name, base):
+    """
+    Scan a directory in a worker process. Return its tree along with the
+    templates parsed, so they can be merged into the parent graph.
+    """
+    graph = TemplateGraph(base, **worker_graph_options)
+    node = scan_directory(path_name, base=base, graph=graph)
+    return node, graph.templates
+
+
+def scan_directory_parallel(path_name, workers, graph=None):
+    """
+    Scan a directory, spreading its top level subdirectories across a pool
+    of worker processes. The tree is the same as with scan_directory.
+
+    Workers are started from a fork server rather than forked from this
+    process, which may run other syncs in threads, as forking a
+    multi-threaded process can deadlock.
+    """
+    if graph is None:
+        graph = TemplateGraph(path_name)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("forkserver"),
+        initializer=init_worker,
+        initargs=(graph.index, graph.blobs),
+    ) as executor:
+        return scan_directory(path_name, graph=graph, executor=executor)
+
+
+def get_dependent_templates(templates, dependencies):
+    """
+    Return the given templates along with every template that inherits
+    from them, directly or through other templates.
+    """
+    dependents = {}
+    for template, extended_template in dependencies.items():
+        dependents.setdefault(extended_template, []).append(template)
+
+    found = set(templates)
+    pending = list(found)
+    while pending:
+        for template in dependents.get(pending.pop(), []):
+            if template not in found:
+                found.add(template)
+                pending.append(template)
+    return found
+
+
+def find_directory_node(tree, base, directory):
+    """
+    Return the node of a directory, given relative to the scan root. Return
+    None if it is not in the tree, or if it can't be told apart from a page
+    with the same name.
+    """
+    node = tree
+    parts = Path(directory).parts
+    for depth in range(1, len(parts) + 1):
+        path = "/".join(parts[:depth])
+        if (base / f"{path}.html").is_file():
+            return None
+        matches = [c for c in node["children"] if c["name"] == "/" + path]
+        if not matches:
+            return None
+        node = matches[0]
     return node
+
+
+def rescan_directory(tree, base, directory, graph):
+    """
+    Rescan a directory, given relative to the scan root, and replace its
+    node in the tree. Directories that can't be located in the tree are
+    handled by rescanning their parent.
+    """
+    if directory == ".":
+        tree.clear()
+        tree.update(scan_directory(str(base), base=base, graph=graph))
+        return
+
+    parent_directory = str(Path(directory).parent)
+    parent = find_directory_node(tree, base, parent_directory)
+    if parent is None:
+        return rescan_directory(tree, base, parent_directory, graph)
+
+    path = base / directory
+    new_node = create_node()
+    if path.is_dir():
+        new_node = scan_directory(str(path), base=base, graph=graph)
+
+    node = find_directory_node(tree, base, directory)
+    if node is None:
+        # The position of a new directory among its siblings is only known
+        # from a listing of the parent
+        has_page = (base / f"{directory}.html").exists()
+        if has_page or not is_empty_node(new_node):
+            rescan_directory(tree, base, parent_directory, graph)
+    elif is_empty_node(new_node):
+        parent["children"].remove(node)
+        # Directories left without pages are removed as well
+        if parent_directory != "." and is_empty_node(parent):
+            rescan_directory(tree, base, parent_directory, graph)
+    else:
+        node.clear()
+        node.update(new_node)
+
+
+def rescan_tree(tree, path_name, changed_templates, dependencies, graph=None):
+    """
+    Update a tree in place after some templates changed, rescanning only
+    the directories holding them or templates that inherit from them.
+
+    Changed templates and dependencies are given relative to the scan root,
+    as returned by TemplateGraph.get_dependencies. Return the dependencies
+    of the updated tree.
+    """
+    base = Path(path_name)
+    if graph is None:
+        graph = TemplateGraph(base)
+
+    templates = get_dependent_templates(changed_templates, dependencies)
+    directories = {str(Path(template).parent) for template in templates}
+    # Directories are rescanned along with their subdirectories
+    directories = [
+        directory
+        for directory in directories
+        if not any(
+            directory != other
+            and (other == "." or directory.startswith(other + "/"))
+            for other in directories
+        )
+    ]
+    for directory in sorted(directories):
+        rescan_directory(tree, base, directory, graph)
+
+    # Unchanged templates keep extending the same templates
+    dependencies = {
+        template: extended_template
+        for template, extended_template in dependencies.items()
+        if template not in changed_templates
+    }
+    dependencies.update(graph.get_dependencies())
+    return dependencies
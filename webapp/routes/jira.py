@@ -8,6 +8,7 @@ from webapp.tasks import LOCKS
 from webapp.helper import (
     create_copy_doc,
     create_jira_task,
+    get_descendants_path,
     get_or_create_user_id,
     get_project_id,
     get_webpage_id,
@@ -45,8 +46,8 @@ def request_changes(body: ChangesRequestModel):
         site_repository = SiteRepository(
             project.name, current_app, task_locks=LOCKS
         )
-        # clean the cache for a new Jira task to appear in the tree
-        site_repository.invalidate_cache()
+        # update the cached tree for the new Jira task to appear in it
+        site_repository.patch_tree_node(webpage.id)
     except Exception as e:
         return jsonify(str(e)), 500
 
@@ -132,6 +133,7 @@ def remove_webpage(body: RemoveWebpageModel):
                         )
                     JiraTask.query.filter_by(id=task.id).delete()
 
+            project_id = webpage.project_id
             Reviewer.query.filter_by(webpage_id=webpage_id).delete()
             db.session.delete(webpage)
             db.session.commit()
@@ -144,6 +146,13 @@ def remove_webpage(body: RemoveWebpageModel):
             )
             return jsonify({"error": "unable to delete the webpage"}), 500
 
+        project = Project.query.filter_by(id=project_id).first()
+        site_repository = SiteRepository(
+            project.name, current_app, task_locks=LOCKS
+        )
+        # remove the page from the cached tree
+        site_repository.remove_tree_node(webpage_id)
+
         return (
             jsonify({"message": "Webpage has been removed successfully"}),
             200,
@@ -176,8 +185,8 @@ def remove_webpage(body: RemoveWebpageModel):
     site_repository = SiteRepository(
         project.name, current_app, task_locks=LOCKS
     )
-    # clean the cache for a page to be removed from the tree
-    site_repository.invalidate_cache()
+    # update the cached tree for the page to be marked for removal
+    site_repository.patch_tree_node(webpage_id)
 
     return (
         jsonify(
@@ -197,6 +206,11 @@ def create_page(body: CreatePageModel):
 
     # Create new webpage
     project_id = get_project_id(data["project"])
+    if get_webpage_id(data["name"], project_id):
+        return jsonify({"error": "webpage already exists"}), 409
+    parent = Webpage.query.filter_by(
+        name=data["parent"], project_id=project_id
+    ).first()
     new_webpage = get_or_create(
         db.session,
         Webpage,
@@ -204,7 +218,8 @@ def create_page(body: CreatePageModel):
         project_id=project_id,
         name=data["name"],
         url=data["name"],
-        parent_id=get_webpage_id(data["parent"], project_id),
+        parent_id=parent.id if parent else None,
+        path=get_descendants_path(parent) if parent else "/",
         owner_id=owner_id,
         status=WebpageStatus.NEW,
     )
@@ -1,5 +1,6 @@
-from flask import jsonify, Blueprint, current_app
+from flask import jsonify, request, Blueprint, current_app
 
+from webapp.helper import find_tree_node, get_tree_view
 from webapp.site_repository import SiteRepository
 from webapp.sso import login_required
 from webapp.tasks import LOCKS
@@ -20,9 +21,30 @@ def get_tree(uri: str, branch: str = "main", no_cache: bool = False):
     site_repository = SiteRepository(
         uri, current_app, branch=branch, task_locks=LOCKS
     )
+    # Optionally, only return part of the tree:
+    # - path: the subtree of the page with this name
+    # - depth: the number of levels of children to return
+    # - fields: comma-separated fields to return for each page
+    path = request.args.get("path")
+    depth = request.args.get("depth")
+    fields = request.args.get("fields")
+    if depth is not None:
+        if not depth.isdigit():
+            return jsonify({"error": "depth must be a positive integer"}), 400
+        depth = int(depth)
+    if fields is not None:
+        fields = set(fields.split(","))
+
     # Getting the site tree here ensures that both the cache and db are updated
     tree = site_repository.get_tree_sync(no_cache)
 
+    if path is not None:
+        tree = find_tree_node(tree, path)
+        if not tree:
+            return jsonify({"error": "webpage not found"}), 404
+    if depth is not None or fields is not None:
+        tree = get_tree_view(tree, depth, fields)
+
     response = jsonify(
         {
             "name": uri,
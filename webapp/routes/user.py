@@ -84,8 +84,8 @@ def set_reviewers():
     site_repository = SiteRepository(
         project.name, current_app, task_locks=LOCKS
     )
-    # clean the cache for a the new reviewers to appear in the tree
-    site_repository.invalidate_cache()
+    # update the cached tree for the new reviewers to appear in it
+    site_repository.patch_tree_node(webpage.id)
 
     return jsonify({"message": "Successfully set reviewers"}), 200
 
@@ -109,7 +109,7 @@ def set_owner():
         site_repository = SiteRepository(
             project.name, current_app, task_locks=LOCKS
         )
-        # clean the cache for a new owner to appear in the tree
-        site_repository.invalidate_cache()
+        # update the cached tree for the new owner to appear in it
+        site_repository.patch_tree_node(webpage_id)
 
     return jsonify({"message": "Successfully set owner"}), 200
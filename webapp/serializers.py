@@ -0,0 +1,177 @@
+from operator import itemgetter
+
+# Columns serialized for each model, in the order they are added to dicts
+USER_FIELDS = [
+    "id",
+    "name",
+    "email",
+    "jira_account_id",
+    "team",
+    "department",
+    "hrc_id",
+    "job_title",
+]
+PROJECT_FIELDS = ["id", "name"]
+REVIEWER_FIELDS = ["id", "user_id", "webpage_id"]
+JIRA_TASK_FIELDS = [
+    "id",
+    "jira_id",
+    "webpage_id",
+    "user_id",
+    "status",
+    "summary",
+]
+WEBPAGE_FIELDS = [
+    "id",
+    "name",
+    "url",
+    "title",
+    "description",
+    "copy_doc_link",
+    "parent_id",
+    "path",
+    "status",
+]
+TIMESTAMP_FIELDS = ["created_at", "updated_at"]
+
+
+def compile_fields(fields):
+    """
+    Return a function that reads the given fields of an object into a dict.
+
+    Fields are read from the loaded state of the object, rather than through
+    its attributes, which is much faster. If a field isn't loaded, all are
+    read through the attributes, which loads them.
+    """
+    getter = itemgetter(*fields)
+
+    def get_fields(instance):
+        try:
+            values = getter(instance.__dict__)
+        except KeyError:
+            values = [getattr(instance, field) for field in fields]
+        return dict(zip(fields, values))
+
+    return get_fields
+
+
+def get_related(instance, name):
+    """Return a relationship of an object, loading it if it isn't yet"""
+    state = instance.__dict__
+    return state[name] if name in state else getattr(instance, name)
+
+
+class TreeSerializer:
+    """
+    Serialize webpages, and their owner, project, reviewers and jira tasks,
+    to the dicts of the tree.
+
+    The fields of each model are read through precompiled getters, and the
+    dicts of users and projects, which are shared by many webpages, are
+    built once per serializer. As these dicts are shared between nodes, they
+    must be replaced rather than modified.
+    """
+
+    get_user_fields = staticmethod(
+        compile_fields(USER_FIELDS + TIMESTAMP_FIELDS)
+    )
+    get_user_details = staticmethod(compile_fields(USER_FIELDS))
+    get_project_fields = staticmethod(
+        compile_fields(PROJECT_FIELDS + TIMESTAMP_FIELDS)
+    )
+    get_reviewer_fields = staticmethod(
+        compile_fields(REVIEWER_FIELDS + TIMESTAMP_FIELDS)
+    )
+    get_jira_task_fields = staticmethod(
+        compile_fields(JIRA_TASK_FIELDS + TIMESTAMP_FIELDS)
+    )
+    get_webpage_fields = staticmethod(
+        compile_fields(WEBPAGE_FIELDS + TIMESTAMP_FIELDS)
+    )
+
+    def __init__(self):
+        # Serialized users and projects, keyed by id
+        self.users = {}
+        self.user_details = {}
+        self.projects = {}
+        # Timestamps in ISO format, keyed by datetime
+        self.timestamps = {}
+
+    def serialize_timestamps(self, data):
+        """Convert the timestamps of a dict to ISO format"""
+        for field in TIMESTAMP_FIELDS:
+            value = data[field]
+            if value is not None:
+                if value not in self.timestamps:
+                    self.timestamps[value] = value.isoformat()
+                data[field] = self.timestamps[value]
+        return data
+
+    def serialize_user(self, user):
+        """Return the dict of a webpage owner"""
+        if not user:
+            return {}
+        if user.id not in self.users:
+            self.users[user.id] = self.serialize_timestamps(
+                self.get_user_fields(user)
+            )
+        return self.users[user.id]
+
+    def serialize_user_details(self, user):
+        """
+        Return the fields of a user that are merged into the dicts of their
+        reviews and jira tasks, without timestamps.
+        """
+        if not user:
+            return {}
+        if user.id not in self.user_details:
+            self.user_details[user.id] = self.get_user_details(user)
+        return self.user_details[user.id]
+
+    def serialize_project(self, project):
+        """Return the dict of a webpage project"""
+        if not project:
+            return {}
+        if project.id not in self.projects:
+            self.projects[project.id] = self.serialize_timestamps(
+                self.get_project_fields(project)
+            )
+        return self.projects[project.id]
+
+    def serialize_reviewer(self, reviewer):
+        """
+        Return the dict of a reviewer, expanded with the fields of its user.
+        The id of the user replaces the id of the reviewer.
+        """
+        data = self.serialize_timestamps(self.get_reviewer_fields(reviewer))
+        data.update(self.serialize_user_details(get_related(reviewer, "user")))
+        return data
+
+    def serialize_jira_task(self, jira_task):
+        """
+        Return the dict of a jira task, expanded with the fields of its
+        user. The id of the user replaces the id of the jira task.
+        """
+        data = self.serialize_timestamps(self.get_jira_task_fields(jira_task))
+        data.update(
+            self.serialize_user_details(get_related(jira_task, "user"))
+        )
+        return data
+
+    def serialize_webpage(self, webpage):
+        """Return the dict of a webpage, without its children"""
+        data = self.serialize_timestamps(self.get_webpage_fields(webpage))
+        data["status"] = data["status"].value
+        data["owner"] = self.serialize_user(get_related(webpage, "owner"))
+        data["project"] = self.serialize_project(
+            get_related(webpage, "project")
+        )
+        data["reviewers"] = [
+            self.serialize_reviewer(reviewer)
+            for reviewer in get_related(webpage, "reviewers")
+        ]
+        data["jira_tasks"] = [
+            self.serialize_jira_task(jira_task)
+            for jira_task in get_related(webpage, "jira_tasks")
+        ]
+        return data
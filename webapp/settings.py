@@ -38,3 +38,25 @@ GOOGLE_CREDENTIALS = {
     "universe_domain": "googleapis.com",
 }
 DEVELOPMENT_MODE = environ.get("DEVEL", True)
+# Number of processes used to scan site templates. Sites are scanned serially
+# by default, as spawning processes isn't worth it for small sites.
+SCAN_WORKERS = int(environ.get("SCAN_WORKERS", 1))
+# Number of sites synced at the same time by the scheduled sync task
+SYNC_WORKERS = int(environ.get("SYNC_WORKERS", 4))
+# Maximum number of parsed templates kept in the template index
+TEMPLATE_INDEX_SIZE = int(environ.get("TEMPLATE_INDEX_SIZE", 20000))
+# Queries running for longer than this, in milliseconds, are logged
+SLOW_QUERY_THRESHOLD = int(environ.get("SLOW_QUERY_THRESHOLD", 500))
+# Add the number of queries of each request and the time spent running them
+# to the Server-Timing header of responses
+SERVER_TIMING = environ.get("SERVER_TIMING", "false").lower() == "true"
+# Number of cached values kept in each process, in front of Valkey. Set to 0
+# to always read from Valkey.
+LOCAL_CACHE_SIZE = int(environ.get("LOCAL_CACHE_SIZE", 32))
+# Maximum size, in bytes, of the files of the cache used when Valkey isn't
+# available
+FILE_CACHE_MAX_SIZE = int(environ.get("FILE_CACHE_MAX_SIZE", 512 * 2**20))
+# Seconds to wait for a tree being loaded by another thread or process
+TREE_LOAD_TIMEOUT = float(environ.get("TREE_LOAD_TIMEOUT", 30))
+# Seconds for which a stale tree is served while it is loaded again
+TREE_MAX_STALENESS = float(environ.get("TREE_MAX_STALENESS", 60))
@@ -1,29 +1,60 @@
+import contextlib
+import copy
 import os
 import re
 import subprocess
-from contextlib import contextmanager
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timezone
 from multiprocessing import Lock
 from pathlib import Path
 from typing import Callable, TypedDict
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import delete, select
+from sqlalchemy import delete, select, update
+from werkzeug.local import LocalProxy
 
 from webapp.helper import (
     convert_webpage_to_dict,
     get_project_id,
+    get_project_webpages,
+    get_tree_index,
     get_tree_struct,
+    get_webpage,
+    replace_tree_node,
 )
 from webapp.models import (
+    BATCH_SIZE,
+    JiraTask,
     Project,
+    Reviewer,
     User,
     Webpage,
     WebpageStatus,
+    bulk_insert,
+    bulk_update,
     db,
     get_or_create,
 )
-from webapp.parse_tree import scan_directory
+from webapp.parse_tree import (
+    TemplateGraph,
+    rescan_tree,
+    scan_directory,
+    scan_directory_parallel,
+)
+from webapp.serializers import TreeSerializer
+
+
+# Webpage columns set from the parsed tree
+SYNCED_COLUMNS = [
+    "title",
+    "description",
+    "copy_doc_link",
+    "parent_id",
+    "path",
+]
 
 
 class SiteRepositoryError(Exception):
@@ -40,12 +71,29 @@ class Tree(TypedDict):
     children: list
 
 
+class SyncChanges(TypedDict):
+    # Names of the webpages changed by a sync
+    created: list
+    updated: list
+    deleted: list
+
+
 class SiteRepository:
     # Directory to clone repositories
     CACHE_KEY_PREFIX = "SITE_REPOSITORY"
+    # Parsed templates, shared by all repositories and branches
+    TEMPLATE_INDEX_KEY = f"{CACHE_KEY_PREFIX}_TEMPLATE_INDEX"
 
     LOCKS: dict = {}
     db: SQLAlchemy = db
+    # Trees being loaded by this process, keyed by cache key
+    TREE_LOADS: dict = {}
+    TREE_LOADS_LOCK = threading.Lock()
+    # Last tree loaded by this process for each cache key
+    LAST_TREES: dict = {}
+    # Seconds between checks of the cache for a tree loaded by another
+    # process
+    TREE_POLL_INTERVAL = 0.1
 
     def __init__(
         self,
@@ -59,11 +107,19 @@ class SiteRepository:
         self.REPOSITORY_DIRECTORY = f"{base_dir}/repositories"
         self.repository_uri = repository_uri
         self.cache_key = f"{self.CACHE_KEY_PREFIX}_{repository_uri}_{branch}"
+        self.scan_cache_key = f"{self.cache_key}_SCAN"
+        self.synced_commit_cache_key = f"{self.cache_key}_SYNCED_COMMIT"
+        self.tree_state_cache_key = f"{self.cache_key}_STATE"
         self.branch = branch
+        # Routes pass current_app, which background threads can't resolve
+        if isinstance(app, LocalProxy):
+            app = app._get_current_object()
         self.app = app
         self.logger = app.logger
         self.cache = app.config["CACHE"]
         self.repo_path = self.get_repo_path(repository_uri)
+        # Webpages changed by the last sync to the database
+        self.sync_changes = None
 
         # If a database is provided, use it
         if db:
@@ -96,38 +152,32 @@ class SiteRepository:
             "Error configuring git",
         )
 
-    @contextmanager
-    def __masked_parent_git__(self):
+    def __git_env__(self):
         """
-        When cloning repositories using sparse-checkout, we temporarily move
-        the parent git folder to *.git-bak.
-        This is to prevent an issue where the sparse checkout also checks
-        out other git repositories in the tree.
+        Environment for git commands.
+
+        Git stops looking for a repository at the repositories directory, so
+        that commands run in a repository that failed to clone, e.g a sparse
+        checkout, can never reach the repository of the app itself.
         """
-        parent_path = f"{self.app.config['BASE_DIR']}/.git"
-        tmp_path = f"{self.app.config['BASE_DIR']}/.git-bak"
-        self.__run__(
-            f"mv {parent_path} {tmp_path}",
-            "Error masking parent git folder",
-        )
-        try:
-            yield
-        finally:
-            self.__run__(
-                f"mv {tmp_path} {parent_path}",
-                "Error unmasking parent git folder",
-            )
+        return {
+            **os.environ,
+            "GIT_CEILING_DIRECTORIES": self.REPOSITORY_DIRECTORY,
+        }
 
-    def __exec__(self, command_str: str):
+    def __exec__(self, command_str: str, cwd: str = None):
         """
-        Execute a command and return the output
+        Execute a command in the given directory and return the output
         """
         command = command_str.strip("").split(" ")
         process = subprocess.Popen(
-            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            env=self.__git_env__(),
         )
-        # Wait for the process to finish
-        process.wait()
+        # Wait for the process to finish, reading its output as it runs
         stdout, stderr = process.communicate()
         if process.returncode != 0:
             raise OSError(f"Execution Error: {stderr.decode('utf-8')}")
@@ -156,13 +206,24 @@ class SiteRepository:
         command_str = command_str.strip()
         return re.sub(r"[(\;\|\|\&|\n)]|", "", command_str)
 
-    def __run__(self, command_str: str, msg="Error executing command: "):
-        """Execute a sanitized command"""
+    def __run__(
+        self,
+        command_str: str,
+        msg="Error executing command: ",
+        cwd: str = None,
+    ):
+        """
+        Execute a sanitized command. Commands run in cwd if it is given,
+        never in a directory set process-wide, so that repositories can be
+        synced from several threads at once.
+        """
         self.logger.info(
             f"exec: {command_str}",
         )
         command_str = self.__sanitize_command__(command_str)
-        return self.__decorate_errors__(self.__exec__, msg)(command_str)
+        return self.__decorate_errors__(self.__exec__, msg)(
+            command_str, cwd=cwd
+        )
 
     def __create_git_uri__(self, uri: str):
         """
@@ -210,6 +271,7 @@ class SiteRepository:
         return self.__run__(
             f"git fetch origin {branch}",
             f"Error fetching branch {branch}",
+            cwd=self.repo_path,
         )
 
     def clone_repo(self, repository_uri: str):
@@ -218,35 +280,29 @@ class SiteRepository:
         """
         github_url = self.__create_git_uri__(repository_uri)
 
-        with self.__masked_parent_git__():
-            # Switch to the ./repositories directory for cloned repositories
-            os.chdir(self.REPOSITORY_DIRECTORY)
-
-            # Clone the repository
-            self.__run__(
-                f"git clone --no-checkout --depth 1 {github_url}",
-                "Error cloning repository",
-            )
-
-            # Change directory to the repository
-            os.chdir(self.repo_path)
-
-            # Set sparse-checkout
-            self.__run__(
-                "git sparse-checkout set templates",
-                "Error setting sparse-checkout",
-            )
+        # Clone the repository into the ./repositories directory
+        self.__run__(
+            f"git clone --no-checkout --depth 1 {github_url} {self.repo_path}",
+            "Error cloning repository",
+            cwd=self.REPOSITORY_DIRECTORY,
+        )
 
-            # Return directory cursor to parent directory
-            os.chdir(self.app.config["BASE_DIR"])
+        # Set sparse-checkout
+        self.__run__(
+            "git sparse-checkout set templates",
+            "Error setting sparse-checkout",
+            cwd=self.repo_path,
+        )
 
     def checkout_branch(self, branch: str):
         """
-        Checkout the branch
+        Checkout the branch, at the head fetched from the remote
         """
         self.fetch_remote_branch(branch)
         return self.__run__(
-            f"git checkout {branch}", f"Error checking out branch {branch}"
+            f"git checkout -B {branch} FETCH_HEAD",
+            f"Error checking out branch {branch}",
+            cwd=self.repo_path,
         )
 
     def pull_updates(self):
@@ -257,6 +313,7 @@ class SiteRepository:
         self.__run__(
             f"git pull origin {self.branch}",
             "Error pulling updates from repository",
+            cwd=self.repo_path,
         )
 
     def setup_site_repository(self):
@@ -282,7 +339,6 @@ class SiteRepository:
         """
         Checkout updates to the repository on the specified branch.
         """
-        os.chdir(self.repo_path)
         # Checkout the branch
         self.checkout_branch(self.branch)
 
@@ -298,27 +354,333 @@ class SiteRepository:
         )
         return os.path.exists(absolute_path)
 
+    def get_tree_entry_from_cache(self):
+        """
+        Get the tree from the cache, along with the position of the node of
+        each webpage, which are cached together for a patch to never read a
+        tree with the index of another. Return None if cache is not
+        available.
+        """
+        if self.cache:
+            entry = self.cache.get(self.cache_key)
+            # Trees cached without their index are loaded again
+            if entry and "index" in entry:
+                return entry
+
     def get_tree_from_cache(self):
         """
         Get the tree from the cache. Return None if cache is not available.
         """
+        if entry := self.get_tree_entry_from_cache():
+            return entry["tree"]
+
+    def get_fresh_tree_from_cache(self):
+        """
+        Get the tree from the cache, unless it is stale.
+        """
+        if self.get_tree_state()["stale_since"] is None:
+            return self.get_tree_from_cache()
+
+    def set_tree_in_cache(self, tree, version: int = None, index: dict = None):
+        """
+        Set the tree in the cache, along with the position of the node of
+        each webpage, and mark it as fresh if it was loaded from the given
+        version. Silently pass if cache is not available.
+        """
         if self.cache:
-            if cached_tree := self.cache.get(self.cache_key):
-                return cached_tree
+            result = self.cache.set(
+                self.cache_key,
+                {
+                    "tree": tree,
+                    "index": get_tree_index(tree) if index is None else index,
+                },
+            )
+            # The tree stays stale if it was invalidated while loading
+            if (
+                version is not None
+                and self.get_tree_state()["version"] == version
+            ):
+                self.cache.set(
+                    self.tree_state_cache_key,
+                    {"version": version, "stale_since": None},
+                )
+            return result
+
+    def patch_tree_node(self, webpage_id: int):
+        """
+        Update the fields of the node of a webpage in the cached tree, from
+        the database, rather than loading the whole tree again. The cached
+        tree is invalidated if it can't be patched.
+        """
+        if not self.__patch_tree__(webpage_id, remove=False):
+            self.invalidate_cache()
+
+    def remove_tree_node(self, webpage_id: int):
+        """
+        Remove the node of a deleted webpage from the cached tree, along
+        with its children. The cached tree is invalidated if it can't be
+        patched.
+        """
+        if not self.__patch_tree__(webpage_id, remove=True):
+            self.invalidate_cache()
+
+    def __patch_tree__(self, webpage_id: int, remove: bool):
+        """
+        Patch the node of a webpage in the cached tree, found through the
+        index of node positions, holding the lock of the tree so that
+        concurrent patches and loads don't overwrite each other. Return
+        whether the tree was patched.
+        """
+        if not self.cache:
+            return False
+        timeout = self.app.config["TREE_LOAD_TIMEOUT"]
+        with self.cache.lock(self.cache_key, timeout) as locked:
+            if not locked or self.get_tree_state()["stale_since"]:
+                return False
+            if not (entry := self.get_tree_entry_from_cache()):
+                return False
+            tree, index = entry["tree"], entry["index"]
+            position = index.get(str(webpage_id))
+            if position is None:
+                return False
+
+            if remove:
+                # The root can't be removed
+                if not position:
+                    return False
+                self.set_tree_in_cache(replace_tree_node(tree, position))
+                return True
+
+            if not (webpage := get_webpage(self.db.session, webpage_id)):
+                return False
+            fields = convert_webpage_to_dict(
+                webpage, webpage.owner, webpage.project
+            )
+            self.set_tree_in_cache(
+                replace_tree_node(tree, position, fields), index=index
+            )
+            return True
 
-    def set_tree_in_cache(self, tree):
+    def get_tree_state(self):
         """
-        Set the tree in the cache. Silently pass if cache is not available.
+        Get the version of the cached tree, incremented each time it is
+        invalidated, and the time since which it is stale, if it is.
         """
         if self.cache:
-            return self.cache.set(self.cache_key, tree)
+            if state := self.cache.get(self.tree_state_cache_key):
+                return state
+        return {"version": 0, "stale_since": None}
 
     def invalidate_cache(self):
-        self.cache.set(self.cache_key, None)
+        """
+        Mark the cached tree as stale. It is still served, for up to
+        TREE_MAX_STALENESS seconds, while it is loaded again.
+        """
+        if self.cache:
+            state = self.get_tree_state()
+            self.cache.set(
+                self.tree_state_cache_key,
+                {
+                    "version": state["version"] + 1,
+                    "stale_since": state["stale_since"] or time.time(),
+                },
+            )
+
+    def get_commit(self):
+        """
+        Get the SHA of the commit checked out in the repository
+        """
+        return self.__run__(
+            "git rev-parse HEAD",
+            "Error reading the checked out commit",
+            cwd=self.repo_path,
+        ).strip()
+
+    def get_remote_commit(self):
+        """
+        Get the SHA of the head of the branch on the remote, without
+        fetching it. Return None if it can't be read.
+        """
+        try:
+            output = self.__run__(
+                f"git ls-remote origin refs/heads/{self.branch}",
+                "Error reading the remote branch",
+                cwd=self.repo_path,
+            )
+        except SiteRepositoryError as e:
+            self.logger.error(e)
+            return None
+        # Lines are formatted as "<sha>\t<ref>"
+        return output.split("\t", 1)[0].strip() or None
+
+    def get_synced_commit(self):
+        """
+        Get the SHA of the commit last synced to the database. Return None
+        if cache is not available.
+        """
+        if self.cache:
+            return self.cache.get(self.synced_commit_cache_key)
+
+    def set_synced_commit(self, commit: str):
+        """
+        Save the SHA of the commit last synced to the database. Silently
+        pass if cache is not available.
+        """
+        if self.cache:
+            return self.cache.set(self.synced_commit_cache_key, commit)
+
+    def is_synced(self):
+        """
+        Return True if the head of the branch on the remote is the commit
+        last synced to the database.
+        """
+        synced_commit = self.get_synced_commit()
+        if not synced_commit or not self.repository_exists():
+            return False
+        return self.get_remote_commit() == synced_commit
+
+    def get_changed_templates(self, old_commit: str, new_commit: str):
+        """
+        Get the templates changed between two commits, relative to the
+        templates folder. Return None if the commits can't be compared.
+        """
+        try:
+            output = self.__run__(
+                "git diff --name-status --no-renames "
+                f"{old_commit}..{new_commit} -- templates",
+                "Error comparing commits",
+                cwd=self.repo_path,
+            )
+        except SiteRepositoryError as e:
+            self.logger.error(e)
+            return None
+
+        changed_templates = []
+        for line in output.splitlines():
+            _, path = line.split("\t", 1)
+            changed_templates.append(path.removeprefix("templates/"))
+        return changed_templates
+
+    def get_scan_from_cache(self):
+        """
+        Get the last parsed tree, along with the commit it was parsed from
+        and the template dependencies. Return None if cache is not
+        available.
+
+        The scan is copied, as its tree is updated by the sync, and cached
+        values may be shared.
+        """
+        if self.cache:
+            return copy.deepcopy(self.cache.get(self.scan_cache_key))
+
+    def set_scan_in_cache(self, commit: str, tree: Tree, dependencies: dict):
+        """
+        Save the last parsed tree. Silently pass if cache is not available.
+        """
+        if self.cache:
+            return self.cache.set(
+                self.scan_cache_key,
+                {
+                    "commit": commit,
+                    "tree": tree,
+                    "dependencies": dependencies,
+                },
+            )
+
+    def get_template_blobs(self):
+        """
+        Get the git blob SHA of each template, relative to the templates
+        folder.
+        """
+        output = self.__run__(
+            "git ls-tree -r HEAD -- templates",
+            "Error listing template blobs",
+            cwd=self.repo_path,
+        )
+        blobs = {}
+        for line in output.splitlines():
+            # Lines are formatted as "<mode> blob <sha>\t<path>"
+            info, path = line.split("\t", 1)
+            blobs[path.removeprefix("templates/")] = info.split(" ")[2]
+        return blobs
+
+    def get_template_index(self):
+        """
+        Get the parse results of templates, keyed by git blob SHA, from the
+        least to the most recently used. Return an empty index if cache is
+        not available.
+        """
+        if self.cache:
+            # Copy the index, as it is updated after the scan
+            return dict(self.cache.get(self.TEMPLATE_INDEX_KEY) or {})
+        return {}
+
+    def update_template_index(self, graph: TemplateGraph):
+        """
+        Add the templates used in a scan to the index, and evict the least
+        recently used templates once the index is over its maximum size.
+        Silently pass if cache is not available.
+
+        The index is shared by the syncs of all sites, so it is read again
+        and written while holding its lock, for concurrent syncs not to drop
+        each other's templates. It is left as is if the lock can't be taken
+        in time, as the index only saves parsing.
+        """
+        if not self.cache:
+            return
+        timeout = self.app.config["TREE_LOAD_TIMEOUT"]
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.cache.lock(self.TEMPLATE_INDEX_KEY, timeout) as locked:
+                if locked:
+                    return self.__merge_template_index__(graph)
+            if time.monotonic() >= deadline:
+                self.logger.warning("Template index is locked, not updated")
+                return
+            time.sleep(self.TREE_POLL_INTERVAL)
+
+    def __merge_template_index__(self, graph: TemplateGraph):
+        index = self.get_template_index()
+        for blob, template in graph.get_index_entries().items():
+            # Move the template to the end, as the most recently used
+            index.pop(blob, None)
+            index[blob] = template
+        for blob in list(index)[: -self.app.config["TEMPLATE_INDEX_SIZE"]]:
+            del index[blob]
+        self.cache.set(self.TEMPLATE_INDEX_KEY, index)
+
+    def get_template_graph(self, templates_folder: str):
+        """
+        Get a template graph that reuses the indexed parse results of the
+        templates checked out.
+        """
+        try:
+            blobs = self.get_template_blobs()
+        except SiteRepositoryError as e:
+            self.logger.error(e)
+            blobs = {}
+        index = self.get_template_index() if blobs else {}
+        return TemplateGraph(templates_folder, index=index, blobs=blobs)
+
+    def scan_templates(self, templates_folder: str, graph: TemplateGraph):
+        """
+        Parse all templates, in parallel if more than one worker is set.
+        Return the tree and the template dependencies.
+        """
+        workers = self.app.config["SCAN_WORKERS"]
+        if workers > 1:
+            tree = scan_directory_parallel(templates_folder, workers, graph)
+        else:
+            tree = scan_directory(templates_folder, graph=graph)
+        return tree, graph.get_dependencies()
 
     def get_tree_from_disk(self):
         """
         Get a tree from a freshly cloned repository.
+
+        If a tree was parsed from an earlier commit, only the templates that
+        changed since, and the templates that inherit from them, are parsed
+        again.
         """
         # Setup the repository
         self.setup_site_repository()
@@ -331,16 +693,42 @@ class SiteRepository:
                 f"repository {self.repo_path}"
             )
 
-        # Change directory to the templates folder
-        os.chdir(templates_folder)
-        # Parse the templates
+        commit = self.get_commit()
+        scan = self.get_scan_from_cache()
+        changed_templates = None
+        if scan:
+            # Nothing to parse if the commit was already parsed
+            if scan["commit"] == commit:
+                return scan["tree"]
+            changed_templates = self.get_changed_templates(
+                scan["commit"], commit
+            )
+
+        graph = self.get_template_graph(templates_folder)
+
         try:
-            tree = scan_directory(os.getcwd())
+            if changed_templates is not None:
+                self.logger.info(
+                    f"Parsing {len(changed_templates)} changed templates "
+                    f"for {self.repository_uri}"
+                )
+                tree = scan["tree"]
+                dependencies = rescan_tree(
+                    tree,
+                    templates_folder,
+                    changed_templates,
+                    scan["dependencies"],
+                    graph,
+                )
+            else:
+                tree, dependencies = self.scan_templates(
+                    templates_folder, graph
+                )
         except Exception as e:
             raise SiteRepositoryError(f"Error scanning directory: {e}")
-        finally:
-            # Change back to the root directory
-            os.chdir("../../..")
+
+        self.set_scan_in_cache(commit, tree, dependencies)
+        self.update_template_index(graph)
         return tree
 
     def get_new_tree(self):
@@ -355,21 +743,23 @@ class SiteRepository:
         # Save the tree metadata to the database and return an updated tree
         # that has all fields
         tree = self.create_webpages_for_tree(self.db, base_tree)
+        self.set_synced_commit(self.get_commit())
 
         self.logger.info(f"Tree loaded for {self.repository_uri}")
         return tree
 
     def get_tree_from_db(self):
-        webpages = self.db.session.execute(
-            select(Webpage).where(
-                Webpage.project_id == get_project_id(self.repository_uri)
-            )
-        ).scalars()
+        webpages = get_project_webpages(
+            self.db.session, get_project_id(self.repository_uri)
+        )
         # build tree from repository in case DB table is empty
         if not webpages:
             self.get_new_tree()
+            webpages = get_project_webpages(
+                self.db.session, get_project_id(self.repository_uri)
+            )
 
-        tree = get_tree_struct(db.session, webpages)
+        tree = get_tree_struct(self.db.session, webpages)
 
         self.logger.info(f"Tree fetched for {self.repository_uri}")
 
@@ -383,90 +773,279 @@ class SiteRepository:
         if not no_cache:
             if tree := self.get_tree_from_cache():
                 return tree
+        # Skip the fetch, scan and database sync if the branch hasn't moved
+        # since the last sync
+        elif self.is_synced():
+            self.logger.info(f"No changes to sync for {self.repository_uri}")
+            return self.get_tree_sync()
 
         self.invalidate_cache()
         return self.get_new_tree()
 
-    def __create_webpage_for_node__(
-        self,
-        db: SQLAlchemy,
-        node: dict,
-        project: Project,
-        owner: User,
-        parent_id: int,
+    def __get_project_webpages__(self, db: SQLAlchemy, project: Project):
+        """
+        Get the fields of the webpages of a project, keyed by name, in a
+        single query.
+        """
+        rows = db.session.execute(
+            select(
+                Webpage.id,
+                Webpage.name,
+                Webpage.title,
+                Webpage.description,
+                Webpage.copy_doc_link,
+                Webpage.parent_id,
+                Webpage.path,
+                Webpage.status,
+            ).where(Webpage.project_id == project.id)
+        )
+        # Names are unique within a project
+        return {row.name: row._asdict() for row in rows}
+
+    def __get_webpage_ids__(
+        self, db: SQLAlchemy, project: Project, names: list[str]
+    ):
+        """
+        Return the ids of webpages of the project, keyed by name
+        """
+        if not names:
+            return {}
+        rows = db.session.execute(
+            select(Webpage.name, Webpage.id).where(
+                Webpage.project_id == project.id, Webpage.name.in_(names)
+            )
+        )
+        return dict(rows.all())
+
+    def __sync_webpages__(
+        self, db: SQLAlchemy, tree: Tree, project: Project, owner: User
     ):
         """
-        Create a webpage from a node in the tree.
+        Create or update a webpage for each node in the tree, and set the id
+        of each node. Return the names of the webpages created and updated.
+
+        Existing webpages are loaded in a single query, and parent ids are
+        resolved in memory, along with their paths. New webpages are
+        inserted one tree level at a time, so that the ids of their parents
+        are known, skipping those created since they were loaded, which are
+        updated instead. Existing webpages are compared with their nodes,
+        and only those that changed are updated at the end, in a single
+        statement.
         """
-        # Get a webpage for this name and project, or create a new one
-        webpage, created = get_or_create(
+        webpages = self.__get_project_webpages__(db, project)
+        created = []
+        updates = {}
+        now = datetime.now(timezone.utc)
+
+        level = [(tree, None, "/")]
+        while level:
+            new_nodes = {}
+            for node, parent, path in level:
+                fields = {
+                    "title": node["title"],
+                    "description": node["description"],
+                    "copy_doc_link": node["link"],
+                    "parent_id": parent["id"] if parent else None,
+                    "path": path,
+                }
+                if webpage := webpages.get(node["name"]):
+                    node["id"] = webpage["id"]
+                    if webpage["status"] == WebpageStatus.NEW:
+                        fields["status"] = WebpageStatus.AVAILABLE
+                    # Only write webpages whose fields changed
+                    if any(webpage[key] != fields[key] for key in fields):
+                        webpage.update(fields)
+                        updates[webpage["id"]] = webpage
+                else:
+                    # Nodes with the same name share a webpage
+                    new_nodes.setdefault(node["name"], []).append(
+                        (node, fields)
+                    )
+
+            rows = [
+                {
+                    "name": name,
+                    "url": name,
+                    "project_id": project.id,
+                    "owner_id": owner.id,
+                    "status": WebpageStatus.AVAILABLE,
+                    "created_at": now,
+                    "updated_at": now,
+                    # The fields of the last node with this name are kept
+                    **nodes[-1][1],
+                }
+                for name, nodes in new_nodes.items()
+            ]
+            ids = bulk_insert(
+                db.session,
+                Webpage,
+                rows,
+                key="name",
+                unique=["project_id", "name"],
+            )
+            # Webpages created concurrently, e.g. from the app, are updated
+            existing_ids = self.__get_webpage_ids__(
+                db,
+                project,
+                [row["name"] for row in rows if row["name"] not in ids],
+            )
+            for row in rows:
+                webpage = {
+                    "id": ids.get(row["name"]) or existing_ids[row["name"]],
+                    "name": row["name"],
+                    "status": row["status"],
+                    **{column: row[column] for column in SYNCED_COLUMNS},
+                }
+                webpages[row["name"]] = webpage
+                for node, _ in new_nodes[row["name"]]:
+                    node["id"] = webpage["id"]
+                if row["name"] in ids:
+                    created.append(row["name"])
+                else:
+                    updates[webpage["id"]] = webpage
+
+            level = [
+                (child, node, f"{path}{node['id']}/")
+                for node, _, path in level
+                for child in node.get("children", [])
+            ]
+
+        bulk_update(
             db.session,
             Webpage,
-            name=node["name"],
-            url=node["name"],
-            project_id=project.id,
-            commit=False,
+            [{**webpage, "updated_at": now} for webpage in updates.values()],
+            [*SYNCED_COLUMNS, "status", "updated_at"],
         )
+        return created, [webpage["name"] for webpage in updates.values()]
+
+    def __add_webpage_fields__(
+        self, db: SQLAlchemy, tree: Tree, project: Project
+    ):
+        """
+        Add the fields of its webpage to each node in the tree, loading the
+        webpages of the project and their relationships in a few queries.
+        """
+        webpages = {
+            webpage.id: webpage
+            for webpage in get_project_webpages(db.session, project.id)
+        }
+
+        serializer = TreeSerializer()
+        nodes = [tree]
+        while nodes:
+            node = nodes.pop()
+            webpage = webpages[node["id"]]
+            node.update(
+                convert_webpage_to_dict(
+                    webpage, webpage.owner, project, serializer
+                )
+            )
+            nodes.extend(node.get("children", []))
+        return tree
 
-        # If instance is new, update the owner and project fields
-        if created:
-            webpage.owner_id = owner.id
-            webpage.project_id = project.id
+    def __remove_webpages_to_delete__(
+        self, db: SQLAlchemy, tree: Tree, project: Project
+    ):
+        """
+        Delete the webpages of the project marked for deletion that are no
+        longer in the tree, and return their names.
 
-        # Update the fields
-        webpage.title = node["title"]
-        webpage.description = node["description"]
-        webpage.copy_doc_link = node["link"]
-        webpage.parent_id = parent_id
-        if webpage.status == WebpageStatus.NEW:
-            webpage.status = WebpageStatus.AVAILABLE
+        Webpages are deleted in batches of ids, along with their reviewers.
+        Their jira tasks are kept, and their children are detached, becoming
+        the roots of their subtrees. The paths of the webpages below them
+        are rewritten in a single statement.
+        """
+        # convert tree of pages from repository to a set of names
+        page_names = []
+        self.add_pages_to_list(tree, page_names)
+        page_names = set(page_names)
 
-        db.session.add(webpage)
-        db.session.flush()
+        webpages_to_delete = db.session.execute(
+            select(Webpage.id, Webpage.name).where(
+                Webpage.project_id == project.id,
+                Webpage.status == WebpageStatus.TO_DELETE,
+            )
+        )
+        purged = [
+            row for row in webpages_to_delete if row.name not in page_names
+        ]
+        if not purged:
+            return []
+        paths = self.__get_detached_paths__(
+            db, project, {row.id for row in purged}
+        )
 
-        webpage_dict = convert_webpage_to_dict(webpage, owner, project)
+        ids = [row.id for row in purged]
+        for start in range(0, len(ids), BATCH_SIZE):
+            batch = ids[start : start + BATCH_SIZE]  # noqa: E203
+            db.session.execute(
+                delete(Reviewer).where(Reviewer.webpage_id.in_(batch))
+            )
+            db.session.execute(
+                update(JiraTask)
+                .where(JiraTask.webpage_id.in_(batch))
+                .values(webpage_id=None)
+            )
+            db.session.execute(
+                update(Webpage)
+                .where(Webpage.parent_id.in_(batch))
+                .values(parent_id=None)
+            )
+            db.session.execute(delete(Webpage).where(Webpage.id.in_(batch)))
 
-        # Return a dict with the webpage fields
-        return {**node, **webpage_dict}
+        bulk_update(db.session, Webpage, paths, ["path"])
 
-    def __create_webpages_for_children__(
-        self, db, children, project, owner, parent_id
+        return [row.name for row in purged]
+
+    def __get_detached_paths__(
+        self, db: SQLAlchemy, project: Project, purged_ids: set[int]
     ):
         """
-        Recursively create webpages for each child in the tree.
+        Return the new paths of the webpages below the purged webpages, as
+        rows of ids and paths. Each webpage keeps the ancestors below the
+        deepest purged one.
         """
-        for child in children:
-            # Create a webpage for the root node
-            webpage_dict = self.__create_webpage_for_node__(
-                db, child, project, owner, parent_id
+        rows = db.session.execute(
+            select(Webpage.id, Webpage.path).where(
+                Webpage.project_id == project.id,
+                # Roots have no ancestors to purge
+                Webpage.path != "/",
             )
-            # Update the child node with the webpage fields
-            child.update(webpage_dict)
-            if child.get("children"):
-                # Create webpages for the children recursively
-                self.__create_webpages_for_children__(
-                    db, child["children"], project, owner, webpage_dict["id"]
-                )
-
-    def __remove_webpages_to_delete__(self, db, tree):
-        # convert tree of pages from repository to list
-        webpages = []
-        self.add_pages_to_list(tree, webpages)
-
-        webpages_to_delete = db.session.execute(
-            select(Webpage).where(Webpage.status == WebpageStatus.TO_DELETE)
         )
-
-        for row in webpages_to_delete:
-            page_to_delete = row[0]
-            if page_to_delete.name not in webpages:
-                db.session.execute(
-                    delete(Webpage).where(Webpage.id == page_to_delete.id)
-                )
+        paths = []
+        for row in rows:
+            if row.id in purged_ids:
+                continue
+            ancestors = row.path.strip("/").split("/")
+            detached = [
+                depth
+                for depth, ancestor in enumerate(ancestors)
+                if int(ancestor) in purged_ids
+            ]
+            if detached:
+                kept = ancestors[detached[-1] + 1 :]  # noqa: E203
+                path = "/" + "".join(f"{ancestor}/" for ancestor in kept)
+                paths.append({"id": row.id, "path": path})
+        return paths
+
+    def log_sync_changes(self, changes: SyncChanges):
+        """
+        Log the number of webpages changed by a sync, and their names.
+        """
+        counts = ", ".join(
+            f"{len(names)} {key}" for key, names in changes.items()
+        )
+        self.logger.info(
+            f"Synced webpages for {self.repository_uri}: {counts}"
+        )
+        for key, names in changes.items():
+            if names:
+                self.logger.debug(f"Webpages {key}: {', '.join(names)}")
 
     def create_webpages_for_tree(self, db: SQLAlchemy, tree: Tree):
         """
-        Create webpages for each node in the tree.
+        Create webpages for each node in the tree. Only the webpages that
+        changed are written, and the changes are kept in sync_changes.
         """
         # Get the default project and owner for new webpages
         project, _ = get_or_create(
@@ -474,40 +1053,44 @@ class SiteRepository:
         )
         owner, _ = get_or_create(db.session, User, name="Default")
 
-        # Create a webpage for the root node
-        webpage_dict = self.__create_webpage_for_node__(
-            db, tree, project, owner, None
-        )
-
-        # Create webpages for the children recursively
-        self.__create_webpages_for_children__(
-            db, webpage_dict["children"], project, owner, webpage_dict["id"]
-        )
+        # Create or update a webpage for each node
+        created, updated = self.__sync_webpages__(db, tree, project, owner)
 
         # Remove pages that don't exist in the repository anymore
-        self.__remove_webpages_to_delete__(db, tree)
+        deleted = self.__remove_webpages_to_delete__(db, tree, project)
 
         db.session.commit()
-        return webpage_dict
+        self.sync_changes = SyncChanges(
+            created=created, updated=updated, deleted=deleted
+        )
+        self.log_sync_changes(self.sync_changes)
+        return self.__add_webpage_fields__(db, tree, project)
 
     def get_tree_sync(self, no_cache: bool = False):
         """
         Try to get the tree from the cache, or create a new task to load it.
+
+        A stale tree is returned from the cache while it is loaded again in
+        the background, unless it has been stale for longer than
+        TREE_MAX_STALENESS seconds.
         """
         # First try to get the tree from the cache
         if not no_cache:
             if tree := self.get_tree_from_cache():
-                return tree
+                self.LAST_TREES[self.cache_key] = tree
+                stale_since = self.get_tree_state()["stale_since"]
+                if stale_since is None:
+                    return tree
+                max_staleness = self.app.config["TREE_MAX_STALENESS"]
+                if time.time() - stale_since <= max_staleness:
+                    self.refresh_tree_in_background()
+                    return tree
         else:
             self.invalidate_cache()
 
-        self.logger.info(f"Loading {self.repository_uri} from database")
         # Load the tree from database
         try:
-            tree = self.get_tree_from_db()
-            # Update the cache
-            self.set_tree_in_cache(tree)
-            return tree
+            return self.load_tree_once()
         except Exception as e:
             self.logger.error(f"Error loading tree: {e}")
 
@@ -520,6 +1103,114 @@ class SiteRepository:
             "children": [],
         }
 
+    def load_tree_once(self):
+        """
+        Load the tree from the database and cache it, unless it is being
+        loaded already, in which case wait for that load instead.
+
+        Threads of a process share a single load of each tree, and a lock in
+        the cache lets a single process load it at a time. The others wait
+        for it to be cached. If the load takes longer than
+        TREE_LOAD_TIMEOUT, the last tree loaded by this process is served.
+        """
+        with self.TREE_LOADS_LOCK:
+            future = self.TREE_LOADS.get(self.cache_key)
+            loading = future is not None
+            if not loading:
+                future = self.TREE_LOADS[self.cache_key] = Future()
+
+        timeout = self.app.config["TREE_LOAD_TIMEOUT"]
+        if loading:
+            try:
+                return future.result(timeout)
+            except TimeoutError:
+                if tree := self.get_last_tree():
+                    return tree
+                raise SiteRepositoryError(
+                    f"Timed out loading the tree of {self.repository_uri}"
+                )
+
+        try:
+            tree = self.__load_tree__(timeout)
+            future.set_result(tree)
+            return tree
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.TREE_LOADS_LOCK:
+                del self.TREE_LOADS[self.cache_key]
+
+    def __load_tree__(self, timeout: float):
+        """
+        Load the tree from the database and cache it, holding the lock of
+        the tree in the cache, or wait for the process holding it to cache
+        the tree.
+        """
+        lock = (
+            self.cache.lock(self.cache_key, timeout)
+            if self.cache
+            else contextlib.nullcontext(True)
+        )
+        with lock as locked:
+            if not locked:
+                tree = self.__wait_for_cached_tree__(timeout)
+            # The tree may have been cached while taking the lock
+            elif not (tree := self.get_fresh_tree_from_cache()):
+                self.logger.info(
+                    f"Loading {self.repository_uri} from database"
+                )
+                version = self.get_tree_state()["version"]
+                tree = self.get_tree_from_db()
+                self.set_tree_in_cache(tree, version)
+        self.LAST_TREES[self.cache_key] = tree
+        return tree
+
+    def refresh_tree_in_background(self):
+        """
+        Load the tree again in a background thread, unless it is being
+        loaded already.
+        """
+        with self.TREE_LOADS_LOCK:
+            if self.cache_key in self.TREE_LOADS:
+                return
+        threading.Thread(target=self.__refresh_tree__, daemon=True).start()
+
+    def __refresh_tree__(self):
+        with self.app.app_context():
+            try:
+                self.load_tree_once()
+            except Exception as e:
+                self.logger.error(f"Error refreshing tree: {e}")
+
+    def __wait_for_cached_tree__(self, timeout: float):
+        """
+        Wait for another process to cache the tree. If it doesn't in time,
+        return the last tree loaded, or load it.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.TREE_POLL_INTERVAL)
+            if tree := self.get_fresh_tree_from_cache():
+                return tree
+        if tree := self.get_last_tree():
+            return tree
+        version = self.get_tree_state()["version"]
+        tree = self.get_tree_from_db()
+        self.set_tree_in_cache(tree, version)
+        return tree
+
+    def get_last_tree(self):
+        """
+        Get the last tree loaded by this process, if any.
+        """
+        if tree := self.LAST_TREES.get(self.cache_key):
+            self.logger.warning(
+                f"Serving the last tree of {self.repository_uri}, as "
+                "loading it timed out"
+            )
+        return tree
+
     def get_task_lock(self):
         """
         Get the lock for the current repository.
@@ -1,12 +1,14 @@
 import functools
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Lock, Process, Queue
 
 import yaml
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 
+from webapp.instrumentation import track_queries
 from webapp.models import db
 from webapp.site_repository import SiteRepository
 
@@ -82,6 +84,79 @@ def execute_tasks_in_queue(queue: Queue):
     queue.get()
 
 
+def sync_site(
+    app: Flask,
+    database: SQLAlchemy,
+    site: str,
+    queue: Queue,
+    task_locks: dict,
+):
+    """
+    Build the tree of a site from its repository, holding the lock of the
+    repository. Return the time taken, the queries run, and the error raised
+    if any.
+    """
+    start = time.perf_counter()
+    error = None
+    with app.app_context(), track_queries(app, f"sync {site}") as queries:
+        site_repository = SiteRepository(
+            site, app, db=database, task_locks=task_locks
+        )
+        try:
+            with site_repository.get_task_lock():
+                # build the tree from GH source without using cache
+                queue.put(site_repository.get_tree(True))
+        except Exception as e:
+            error = e
+    duration = time.perf_counter() - start
+
+    if error:
+        app.logger.error(
+            f"Error syncing {site} after {duration:.1f}s: {error}"
+        )
+    else:
+        app.logger.info(f"Synced {site} in {duration:.1f}s, with {queries}")
+    return {
+        "site": site,
+        "duration": duration,
+        "queries": queries.count,
+        "query_duration": queries.duration,
+        "error": error,
+    }
+
+
+def sync_sites(
+    app: Flask,
+    database: SQLAlchemy,
+    sites: list,
+    queue: Queue,
+    task_locks: dict,
+):
+    """
+    Sync sites concurrently, with at most SYNC_WORKERS at a time, so that a
+    slow or failing site doesn't hold up the others. Return the result of
+    each sync, in the order of the sites.
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(
+        max_workers=app.config["SYNC_WORKERS"]
+    ) as executor:
+        results = list(
+            executor.map(
+                lambda site: sync_site(app, database, site, queue, task_locks),
+                sites,
+            )
+        )
+
+    failed = [result["site"] for result in results if result["error"]]
+    app.logger.info(
+        f"Synced {len(sites) - len(failed)} of {len(sites)} sites in "
+        f"{time.perf_counter() - start:.1f}s"
+        + (f", failed: {', '.join(failed)}" if failed else "")
+    )
+    return results
+
+
 @scheduled_task(delay=TASK_DELAY)
 def load_site_trees(
     app: Flask, database: SQLAlchemy, queue: Queue, task_locks: dict
@@ -92,10 +167,4 @@ def load_site_trees(
     app.logger.info("Running scheduled task: load_site_trees")
     with open(app.config["BASE_DIR"] + "/" + "sites.yaml") as f:
         data = yaml.safe_load(f)
-        for site in data["sites"]:
-            # Enqueue the sites for setup
-            site_repository = SiteRepository(
-                site, app, db=database, task_locks=task_locks
-            )
-            # build the tree from GH source without using cache
-            queue.put(site_repository.get_tree(True))
+    sync_sites(app, database, data["sites"], queue, task_locks)
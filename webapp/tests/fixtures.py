@@ -1,9 +1,149 @@
+import queue
+import time
+
 import pytest
 
 from webapp import create_app
+from webapp.cache import FileCache, TieredCache
 from webapp.models import Project, Webpage, db
 
 
+def create_app_without_tasks():
+    """
+    Create the app, without starting the background tasks on the first
+    request.
+    """
+    app = create_app()
+    app.before_request_funcs[None] = [
+        func
+        for func in app.before_request_funcs[None]
+        if func.__name__ != "start_tasks"
+    ]
+    return app
+
+
+def create_page(name, children=()):
+    """
+    Create a node of a tree, as scanned from the templates of a site
+    """
+    return {
+        "name": name,
+        "title": name.title(),
+        "description": None,
+        "link": None,
+        "children": list(children),
+    }
+
+
+def create_tree():
+    return create_page(
+        "",
+        [
+            create_page("/server", [create_page("/server/maas")]),
+            create_page("/desktop"),
+        ],
+    )
+
+
+class FakeValkey:
+    """
+    In-memory stand-in for a Valkey server, with the commands used by the
+    cache.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.subscribers = []
+        self.reads = 0
+
+    def ping(self):
+        return True
+
+    def get(self, key):
+        self.reads += 1
+        return self.values.get(key)
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    def eval(self, script, numkeys, key, token):
+        # The compare-and-delete script releasing locks
+        if self.values.get(key) == token:
+            return self.delete(key)
+        return 0
+
+    def incr(self, key):
+        self.values[key] = int(self.values.get(key, 0)) + 1
+        return self.values[key]
+
+    def delete(self, key):
+        return int(self.values.pop(key, None) is not None)
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def publish(self, channel, data):
+        for subscriber in self.subscribers:
+            subscriber.put({"type": "message", "data": data})
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return FakePubSub(self)
+
+
+class FakePipeline:
+    def __init__(self, server):
+        self.server = server
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name, args))
+
+    def execute(self):
+        return [
+            getattr(self.server, name)(*args) for name, args in self.commands
+        ]
+
+
+class FakePubSub:
+    def __init__(self, server):
+        self.server = server
+        self.messages = queue.Queue()
+
+    def subscribe(self, channel):
+        self.server.subscribers.append(self.messages)
+
+    def listen(self):
+        while True:
+            yield self.messages.get()
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 2
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def create_tiered_cache(app):
+    """
+    Create a TieredCache, once it listens to invalidations
+    """
+    cache = TieredCache(app)
+    wait_for(lambda: cache.listening)
+    return cache
+
+
+def create_file_cache(app, tmp_path):
+    """
+    Create a FileCache in a temporary directory rather than in BASE_DIR
+    """
+    app.config["BASE_DIR"] = str(tmp_path)
+    return FileCache(app)
+
+
 @pytest.fixture(scope="session")
 def db_session():
     app = create_app()
@@ -0,0 +1,136 @@
+import os
+
+import pytest
+
+from webapp import create_app
+from webapp.cache import FileCache, ValkeyCache
+from webapp.site_repository import SiteRepository
+from webapp.tests.fixtures import (
+    FakeValkey,
+    create_file_cache,
+    create_tiered_cache,
+    wait_for,
+)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = FakeValkey()
+    monkeypatch.setattr(ValkeyCache, "connect", lambda self: server)
+    return server
+
+
+def create_cache(size=32):
+    app = create_app()
+    app.config["LOCAL_CACHE_SIZE"] = size
+    return create_tiered_cache(app)
+
+
+def test_tiered_cache_reads_from_process(server):
+    cache = create_cache()
+    cache.set("tree", {"name": "/"})
+
+    assert cache.get("tree") == {"name": "/"}
+    reads = server.reads
+    assert cache.get("tree") is cache.get("tree")
+    assert server.reads == reads
+
+
+def test_tiered_cache_invalidates_other_processes(server):
+    cache, other_cache = create_cache(), create_cache()
+    cache.set("tree", {"name": "/"})
+    assert other_cache.get("tree") == {"name": "/"}
+
+    cache.set("tree", {"name": "/server"})
+    wait_for(lambda: other_cache.get("tree") == {"name": "/server"})
+
+    cache.delete("tree")
+    wait_for(lambda: other_cache.get("tree") is None)
+
+
+def test_tiered_cache_evicts_least_recently_used(server):
+    cache = create_cache(size=2)
+    for key in ["a", "b", "c"]:
+        cache.set(key, key)
+        cache.get(key)
+
+    assert list(cache.local) == ["b", "c"]
+
+
+def test_tiered_cache_skips_values_invalidated_while_read(server):
+    cache = create_cache()
+    cache.set("tree", {"name": "/"})
+    # A newer version was published while the old value was read
+    cache.versions["tree"] = 2
+
+    assert cache.get("tree") == {"name": "/"}
+    assert "tree" not in cache.local
+
+
+def test_tiered_cache_lock(server):
+    cache = create_cache()
+
+    with cache.lock("tree", 5) as locked:
+        assert locked
+        with cache.lock("tree", 5) as other_locked:
+            assert not other_locked
+    with cache.lock("tree", 5) as locked:
+        assert locked
+
+
+def test_tiered_cache_loads_tree(server, monkeypatch):
+    monkeypatch.setattr(SiteRepository, "LAST_TREES", {})
+    monkeypatch.setattr(
+        SiteRepository,
+        "get_tree_from_db",
+        lambda self: {"name": "", "children": []},
+    )
+    app = create_app()
+    app.config["CACHE"] = create_tiered_cache(app)
+    site_repository = SiteRepository("ubuntu.com", app)
+
+    assert site_repository.get_tree_sync() == {"name": "", "children": []}
+    assert site_repository.get_fresh_tree_from_cache() == {
+        "name": "",
+        "children": [],
+    }
+
+
+def create_sized_file_cache(tmp_path, max_size=2**20):
+    app = create_app()
+    app.config["FILE_CACHE_MAX_SIZE"] = max_size
+    return create_file_cache(app, tmp_path)
+
+
+def test_file_cache(tmp_path):
+    cache = create_sized_file_cache(tmp_path)
+
+    cache.set("tree", {"name": "/"})
+    cache.set("tree", {"name": "/server"})
+
+    assert cache.get("tree") == {"name": "/server"}
+    path = cache.get_file_path(f"{FileCache.CACHE_PREFIX}_tree")
+    assert path.parent.name == path.name[:2]
+    # Temporary files are renamed into place
+    assert list(path.parent.iterdir()) == [path]
+    cache.delete("tree")
+    cache.delete("tree")
+    assert cache.get("tree") is None
+
+
+def test_file_cache_evicts_least_recently_used(tmp_path):
+    cache = create_sized_file_cache(tmp_path, max_size=250)
+    value = "x" * 100
+    for key in ["a", "b"]:
+        cache.set(key, value)
+    # Reading a key makes it the most recently used
+    path = cache.get_file_path(f"{FileCache.CACHE_PREFIX}_a")
+    os.utime(path, (0, 0))
+    cache.get("a")
+    os.utime(cache.get_file_path(f"{FileCache.CACHE_PREFIX}_b"), (1, 1))
+
+    cache.set("c", value)
+
+    assert cache.get("a") == value
+    assert cache.get("b") is None
+    assert cache.get("c") == value
@@ -0,0 +1,53 @@
+import pytest
+from sqlalchemy import select
+
+from webapp.instrumentation import track_queries
+from webapp.models import Project, db
+from webapp.tests.fixtures import create_app_without_tasks
+
+
+@pytest.fixture
+def app():
+    app = create_app_without_tasks()
+
+    @app.route("/projects")
+    def projects():
+        names = db.session.execute(select(Project.name)).scalars()
+        return {"projects": list(names)}
+
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.drop_all()
+
+
+def test_server_timing_header(app):
+    client = app.test_client()
+
+    response = client.get("/projects")
+    assert "Server-Timing" not in response.headers
+
+    app.config["SERVER_TIMING"] = True
+    response = client.get("/projects")
+    # The default project and user were created by the first request
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+    assert response.headers["Server-Timing"].endswith('desc="1 queries"')
+
+
+def test_track_queries_logs_slow_queries(app, caplog):
+    app.config["SLOW_QUERY_THRESHOLD"] = 0
+
+    with app.app_context(), track_queries(app, "sync ubuntu.com") as stats:
+        db.session.execute(select(Project)).all()
+        db.session.execute(select(Project.name)).all()
+
+    assert stats.count == 2
+    assert stats.duration > 0
+    assert "Slow query" in caplog.text
+    assert "for sync ubuntu.com: SELECT projects.name" in caplog.text
+
+    # Queries outside of the context aren't counted
+    with app.app_context():
+        db.session.execute(select(Project)).all()
+    assert stats.count == 2
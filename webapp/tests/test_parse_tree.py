@@ -0,0 +1,267 @@
+import io
+import random
+
+import pytest
+
+from webapp.parse_tree import (
+    TemplateGraph,
+    get_tags_rolling_buffer,
+    rescan_tree,
+    scan_directory,
+    scan_directory_parallel,
+)
+
+
+def test_get_tags_rolling_buffer(tmp_path):
+    page = tmp_path / "templates" / "server" / "page.html"
+    page.parent.mkdir(parents=True)
+    page.write_text(
+        '{% extends "templates/base.html" %}\n'
+        "{% block title %}Search{% if query %} results{% endif %}"
+        "{% endblock %}\n"
+        "{% block description %}Fallback{% endblock %}\n"
+        "{% block meta_description %}\n"
+        "  Server page\n"
+        "{% endblock %}\n"
+        "{% block meta_copydoc %}https://docs.google.com/1{% endblock %}\n"
+    )
+
+    tags = get_tags_rolling_buffer(page)
+
+    assert tags["name"] == "/server/page"
+    assert tags["title"] == " results"
+    assert tags["description"] == "Server page"
+    assert tags["link"] == "https://docs.google.com/1"
+    assert tags["children"] == []
+
+
+def test_get_tags_rolling_buffer_description_fallback(tmp_path):
+    page = tmp_path / "templates" / "index.html"
+    page.parent.mkdir(parents=True)
+    page.write_text(
+        "{% block title%}Home{%endblock%}\n"
+        "{% block description %}Description{% endblock %}\n"
+    )
+
+    tags = get_tags_rolling_buffer(page)
+
+    assert tags["name"] == ""
+    assert tags["title"] == "Home"
+    assert tags["description"] == "Description"
+    assert tags["link"] is None
+
+
+def test_template_graph_extends_base(tmp_path):
+    templates = tmp_path / "templates"
+    (templates / "server").mkdir(parents=True)
+    (templates / "_layout.html").write_text(
+        '{% extends "templates/base.html" %}'
+    )
+    (templates / "server" / "page.html").write_text(
+        '{% extends "/_layout.html" %}'
+    )
+    (templates / "loop_a.html").write_text('{% extends "loop_b.html" %}')
+    (templates / "loop_b.html").write_text('{% extends "loop_a.html" %}')
+    graph = TemplateGraph(templates)
+
+    assert graph.extends_base(templates / "server" / "page.html")
+    assert graph.extends_base(templates / "_layout.html")
+    assert not graph.extends_base(templates / "loop_a.html")
+    assert not graph.extends_base(templates / "missing.html")
+    assert graph.get_extended_path(templates / "server" / "page.html") == (
+        "/_layout.html"
+    )
+
+
+def test_template_graph_reads_copydoc_once(tmp_path, monkeypatch):
+    templates = tmp_path / "templates"
+    (templates / "server").mkdir(parents=True)
+    (templates / "server" / "_base_layout.html").write_text(
+        '{% extends "templates/base.html" %}\n'
+        "{% block meta_copydoc %}https://docs.google.com/1{% endblock %}\n"
+    )
+    (templates / "server" / "index.html").write_text(
+        '{% extends "server/_base_layout.html" %}{% block title %}Server'
+        "{% endblock %}"
+    )
+    for number in range(3):
+        (templates / "server" / f"page-{number}.html").write_text(
+            '{% extends "server/_base_layout.html" %}{% block title %}Page'
+            "{% endblock %}"
+        )
+    graph = TemplateGraph(templates)
+    opened = []
+    original_open = io.open
+    monkeypatch.setattr(
+        io,
+        "open",
+        lambda file, *args, **kwargs: (
+            opened.append(str(file)) or original_open(file, *args, **kwargs)
+        ),
+    )
+
+    tree = scan_directory(str(templates), graph=graph)
+
+    server = tree["children"][0]
+    assert [page["link"] for page in server["children"]] == [
+        "https://docs.google.com/1"
+    ] * 3
+    # The layout is read once, for both its parent and its copydoc
+    layout = str(templates / "server" / "_base_layout.html")
+    assert opened.count(layout) == 1
+
+
+def test_scan_directory_parallel_matches_serial(tmp_path):
+    templates = tmp_path / "templates"
+    for section in ["templates", "server", "data", "empty", "kubernetes"]:
+        (templates / section).mkdir(parents=True)
+    (templates / "templates" / "base.html").write_text("<html></html>")
+    (templates / "index.html").write_text(
+        '{% extends "templates/base.html" %}{% block title %}Home'
+        "{% endblock %}"
+    )
+    for section in ["server", "data", "kubernetes"]:
+        (templates / section / "index.html").write_text(
+            '{% extends "templates/base.html" %}'
+            f"{{% block title %}}{section}{{% endblock %}}"
+        )
+        (templates / section / "page.html").write_text(
+            '{% extends "templates/base.html" %}'
+        )
+
+    serial = scan_directory(str(templates))
+    parallel = scan_directory_parallel(str(templates), workers=2)
+
+    assert parallel == serial
+    assert [child["name"] for child in parallel["children"]] == [
+        child["name"] for child in serial["children"]
+    ]
+
+
+def test_rescan_tree_matches_full_scan(tmp_path):
+    templates = tmp_path / "templates"
+    for section in ["templates", "server", "server/maas", "data"]:
+        (templates / section).mkdir(parents=True)
+    (templates / "templates" / "base.html").write_text("<html></html>")
+    (templates / "index.html").write_text(
+        '{% extends "templates/base.html" %}'
+    )
+    (templates / "_layout.html").write_text(
+        '{% extends "templates/base.html" %}'
+    )
+    for section in ["server", "server/maas", "data"]:
+        (templates / section / "index.html").write_text(
+            '{% extends "_layout.html" %}'
+            f"{{% block title %}}{section}{{% endblock %}}"
+        )
+    graph = TemplateGraph(templates)
+    tree = scan_directory(str(templates), graph=graph)
+
+    # Pages inheriting from a changed layout are parsed again
+    (templates / "_layout.html").write_text('{% extends "missing.html" %}')
+    (templates / "data" / "new").mkdir()
+    (templates / "data" / "new" / "index.html").write_text(
+        '{% extends "templates/base.html" %}{% block title %}New{% endblock %}'
+    )
+    dependencies = rescan_tree(
+        tree,
+        str(templates),
+        ["_layout.html", "data/new/index.html"],
+        graph.get_dependencies(),
+    )
+
+    graph = TemplateGraph(templates)
+    assert tree == scan_directory(str(templates), graph=graph)
+    assert dependencies == graph.get_dependencies()
+
+
+def test_rescan_tree_removes_emptied_directories(tmp_path):
+    templates = tmp_path / "templates"
+    (templates / "a" / "b").mkdir(parents=True)
+    (templates / "a" / "b" / "page.html").write_text(
+        '{% extends "templates/base.html" %}'
+    )
+    graph = TemplateGraph(templates)
+    tree = scan_directory(str(templates), graph=graph)
+
+    (templates / "a" / "b" / "page.html").unlink()
+    rescan_tree(
+        tree, str(templates), ["a/b/page.html"], graph.get_dependencies()
+    )
+
+    assert tree == scan_directory(str(templates))
+    assert tree["children"] == []
+
+
+def write_random_page(templates, rng):
+    directory = templates.joinpath(
+        *rng.sample(["a", "b", "c"], rng.randint(0, 2))
+    )
+    directory.mkdir(parents=True, exist_ok=True)
+    page = directory / rng.choice(["index.html", "page.html", "_layout.html"])
+    extends = rng.choice(
+        ["templates/base.html", "_layout.html", "a/_layout.html"]
+    )
+    page.write_text(
+        f'{{% extends "{extends}" %}}'
+        f"{{% block title %}}{rng.random()}{{% endblock %}}"
+    )
+    return page
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_rescan_tree_matches_full_scan_of_random_sites(tmp_path, seed):
+    rng = random.Random(seed)
+    templates = tmp_path / "templates"
+    (templates / "templates").mkdir(parents=True)
+    (templates / "templates" / "base.html").write_text("<html></html>")
+    for _ in range(rng.randint(1, 8)):
+        write_random_page(templates, rng)
+    graph = TemplateGraph(templates)
+    tree = scan_directory(str(templates), graph=graph)
+
+    # Add, change and delete a few pages
+    pages = sorted(
+        set(templates.rglob("*.html"))
+        - {templates / "templates" / "base.html"}
+    )
+    changed = rng.sample(pages, rng.randint(0, len(pages)))
+    for page in changed:
+        page.unlink()
+    changed += [
+        write_random_page(templates, rng) for _ in range(rng.randint(0, 3))
+    ]
+    dependencies = rescan_tree(
+        tree,
+        str(templates),
+        [str(page.relative_to(templates)) for page in changed],
+        graph.get_dependencies(),
+    )
+
+    graph = TemplateGraph(templates)
+    assert tree == scan_directory(str(templates), graph=graph)
+    # Unchanged pages skipped by the full scan keep their dependencies,
+    # which can only cause extra rescans
+    assert graph.get_dependencies().items() <= dependencies.items()
+
+
+def test_template_graph_uses_index(tmp_path):
+    templates = tmp_path / "templates"
+    templates.mkdir()
+    (templates / "page.html").write_text('{% extends "base_index.html" %}')
+    index = {
+        "abc123": {
+            "extends": "templates/base.html",
+            "tags": {"title": "Indexed", "description": None, "link": None},
+        }
+    }
+    blobs = {"page.html": "abc123"}
+    graph = TemplateGraph(templates, index=index, blobs=blobs)
+
+    tags = get_tags_rolling_buffer(templates / "page.html", graph)
+
+    assert tags["title"] == "Indexed"
+    assert graph.get_extended_path(templates / "page.html") == (
+        "templates/base.html"
+    )
+    assert graph.get_index_entries() == index
@@ -0,0 +1,326 @@
+"""
+Upper bounds on the number of SQL statements run by each API endpoint and
+sync stage, for a site large enough that a query per webpage, reviewer or
+jira task would exceed them.
+"""
+
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event, select, update
+
+from webapp.cache import ValkeyCache
+from webapp.models import (
+    JiraTask,
+    Project,
+    Reviewer,
+    User,
+    Webpage,
+    WebpageStatus,
+    db,
+)
+from webapp.routes.jira import jira_blueprint
+from webapp.routes.tree import tree_blueprint
+from webapp.routes.user import user_blueprint
+from webapp.site_repository import SiteRepository
+from webapp.tests.fixtures import (
+    FakeValkey,
+    create_app_without_tasks,
+    create_file_cache,
+    create_page,
+    create_tiered_cache,
+)
+
+# Number of sections in the site, each with a few pages
+SECTIONS = 10
+
+
+def create_large_tree():
+    return create_page(
+        "",
+        [
+            create_page(
+                f"/section-{section}",
+                [
+                    create_page(f"/section-{section}/page-{page}")
+                    for page in range(3)
+                ],
+            )
+            for section in range(SECTIONS)
+        ],
+    )
+
+
+def create_user(id):
+    return {
+        "id": id,
+        "name": f"User {id}",
+        "email": f"user-{id}@example.com",
+        "team": None,
+        "department": None,
+        "jobTitle": None,
+    }
+
+
+@contextmanager
+def count_statements():
+    """
+    Collect the SQL statements run by the database engine
+    """
+    statements = []
+
+    def collect(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", collect)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", collect)
+
+
+class MemoryCache:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    @contextmanager
+    def lock(self, key, timeout):
+        yield True
+
+
+class FakeJira:
+    def create_issue(self, **kwargs):
+        return {"key": "WD-1"}
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr("webapp.sso.DISABLE_SSO", True)
+    app = create_app_without_tasks()
+    # Start with an empty cache
+    app.config["CACHE"] = MemoryCache()
+    app.config["JIRA"] = FakeJira()
+    for blueprint in [tree_blueprint, user_blueprint, jira_blueprint]:
+        app.register_blueprint(blueprint)
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        site_repository = SiteRepository("ubuntu.com", app, db=db)
+        site_repository.create_webpages_for_tree(db, create_large_tree())
+        users = [User(name=f"User {id}", hrc_id=id) for id in range(3)]
+        db.session.add_all(users)
+        db.session.flush()
+        for webpage in db.session.execute(select(Webpage)).scalars():
+            db.session.add_all(
+                [
+                    Reviewer(user_id=user.id, webpage_id=webpage.id)
+                    for user in users
+                ]
+                + [
+                    JiraTask(
+                        jira_id="WD-0",
+                        webpage_id=webpage.id,
+                        user_id=users[0].id,
+                    )
+                ]
+            )
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    # Create the default project and user before counting
+    client.get("/_status/check")
+    return client
+
+
+def get_webpage_id(app, name):
+    with app.app_context():
+        return db.session.execute(
+            select(Webpage.id).where(Webpage.name == name)
+        ).scalar_one()
+
+
+@pytest.mark.parametrize(
+    "method, url, body, max_statements",
+    [
+        ("get", "/api/get-tree/ubuntu.com/main", None, 4),
+        ("get", "/api/get-tree/ubuntu.com/main/no-cache", None, 4),
+        ("get", "/api/get-jira-tasks/{id}", None, 1),
+        (
+            "post",
+            "/api/set-reviewers",
+            {
+                "webpage_id": "{id}",
+                "user_structs": [create_user(0), create_user(1)],
+            },
+            10,
+        ),
+        (
+            "post",
+            "/api/set-owner",
+            {"webpage_id": "{id}", "user_struct": create_user(2)},
+            5,
+        ),
+        (
+            "post",
+            "/api/create-page",
+            {
+                "project": "ubuntu.com",
+                "name": "/section-0/new",
+                "copy_doc": "https://docs.google.com/document/d/1",
+                "owner": create_user(0),
+                "reviewers": [create_user(1)],
+                "parent": "/section-0",
+            },
+            10,
+        ),
+        (
+            "post",
+            "/api/request-changes",
+            {
+                "due_date": "2030-01-01",
+                "reporter_id": 1,
+                "webpage_id": "{id}",
+                "type": 0,
+                "description": "Update the copy",
+            },
+            5,
+        ),
+    ],
+)
+def test_endpoint_statements(app, client, method, url, body, max_statements):
+    id = get_webpage_id(app, "/section-0/page-0")
+    url = url.format(id=id)
+    if body and body.get("webpage_id") == "{id}":
+        body = {**body, "webpage_id": id}
+
+    with app.app_context(), count_statements() as statements:
+        response = getattr(client, method)(url, json=body)
+
+    assert response.status_code < 300, response.json
+    assert len(statements) <= max_statements, "\n".join(statements)
+
+
+def test_sync_stage_statements(app):
+    with app.app_context():
+        site_repository = SiteRepository("ubuntu.com", app, db=db)
+        project = db.session.execute(
+            select(Project).where(Project.name == "ubuntu.com")
+        ).scalar_one()
+        owner = db.session.execute(
+            select(User).where(User.name == "Default")
+        ).scalar_one()
+        # Sections removed from the repository are purged, and their pages
+        # detached
+        purged = ["/section-1", "/section-2", "/section-3", "/section-4"]
+        db.session.execute(
+            update(Webpage)
+            .where(Webpage.name.in_(purged))
+            .values(status=WebpageStatus.TO_DELETE)
+        )
+        tree = create_large_tree()
+        tree["children"] = [
+            child for child in tree["children"] if child["name"] not in purged
+        ]
+        tree["children"][0]["title"] = "Changed"
+        tree["children"].append(
+            {
+                "name": "/new",
+                "title": "New",
+                "description": None,
+                "link": None,
+                "children": [],
+            }
+        )
+
+        with count_statements() as statements:
+            site_repository.__sync_webpages__(db, tree, project, owner)
+        # A select, an insert per new tree level, and an update
+        assert len(statements) <= 3
+
+        with count_statements() as statements:
+            deleted = site_repository.__remove_webpages_to_delete__(
+                db, tree, project
+            )
+        assert sorted(deleted) == purged
+        # Two selects, a batch of deletes and updates, and the new paths
+        assert len(statements) <= 7
+        db.session.commit()
+        detached = db.session.execute(
+            select(Webpage.parent_id, Webpage.path).where(
+                Webpage.name == "/section-1/page-0"
+            )
+        ).one()
+        assert detached == (None, "/")
+
+        with count_statements() as statements:
+            site_repository.__add_webpage_fields__(db, tree, project)
+        assert len(statements) <= 4
+
+        with count_statements() as statements:
+            site_repository.get_tree_from_db()
+        assert len(statements) <= 4
+
+
+def create_memory_cache(app, tmp_path, monkeypatch):
+    return MemoryCache()
+
+
+def create_valkey_cache(app, tmp_path, monkeypatch):
+    server = FakeValkey()
+    monkeypatch.setattr(ValkeyCache, "connect", lambda self: server)
+    app.config["LOCAL_CACHE_SIZE"] = 32
+    return create_tiered_cache(app)
+
+
+def create_temporary_file_cache(app, tmp_path, monkeypatch):
+    return create_file_cache(app, tmp_path)
+
+
+@pytest.mark.parametrize(
+    "create_cache",
+    [create_memory_cache, create_valkey_cache, create_temporary_file_cache],
+    ids=["memory", "tiered", "file"],
+)
+def test_set_owner_patches_cached_tree(
+    app, client, tmp_path, monkeypatch, create_cache
+):
+    monkeypatch.setattr(SiteRepository, "LAST_TREES", {})
+    app.config["CACHE"] = create_cache(app, tmp_path, monkeypatch)
+    id = get_webpage_id(app, "/section-0/page-0")
+    client.get("/api/get-tree/ubuntu.com/main")
+    response = client.post(
+        "/api/set-owner",
+        json={"webpage_id": id, "user_struct": create_user(2)},
+    )
+    assert response.status_code == 200, response.json
+
+    # The cached tree is up to date, so it isn't loaded again
+    with app.app_context(), count_statements() as statements:
+        tree = client.get("/api/get-tree/ubuntu.com/main").json["templates"]
+    assert len(statements) <= 2, "\n".join(statements)
+    section = next(
+        child for child in tree["children"] if child["name"] == "/section-0"
+    )
+    page = next(
+        child
+        for child in section["children"]
+        if child["name"] == "/section-0/page-0"
+    )
+    assert page["owner"]["name"] == "User 2"
+    assert page["children"] == []
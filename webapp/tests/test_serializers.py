@@ -0,0 +1,89 @@
+from datetime import datetime
+
+from webapp.models import (
+    JiraTask,
+    Project,
+    Reviewer,
+    User,
+    Webpage,
+    WebpageStatus,
+)
+from webapp.serializers import TreeSerializer
+
+
+def create_webpage(webpage_id, owner, project):
+    timestamp = datetime(2024, 10, 1, 12, 30)
+    reviewer = User(id=2, name="Reviewer", created_at=timestamp)
+    return Webpage(
+        id=webpage_id,
+        name=f"/page-{webpage_id}",
+        url=f"/page-{webpage_id}",
+        title="Page",
+        description=None,
+        copy_doc_link=None,
+        parent_id=1,
+        status=WebpageStatus.AVAILABLE,
+        created_at=timestamp,
+        updated_at=timestamp,
+        owner=owner,
+        project=project,
+        reviewers=[
+            Reviewer(
+                id=10,
+                user_id=2,
+                webpage_id=webpage_id,
+                created_at=timestamp,
+                updated_at=timestamp,
+                user=reviewer,
+            )
+        ],
+        jira_tasks=[
+            JiraTask(
+                id=20,
+                jira_id="WD-1",
+                webpage_id=webpage_id,
+                user_id=2,
+                status="TRIAGED",
+                summary="Copy update",
+                created_at=timestamp,
+                updated_at=timestamp,
+                user=reviewer,
+            )
+        ],
+    )
+
+
+def test_tree_serializer():
+    timestamp = datetime(2024, 10, 1, 12, 30)
+    owner = User(
+        id=1, name="Owner", created_at=timestamp, updated_at=timestamp
+    )
+    project = Project(
+        id=1, name="ubuntu.com", created_at=timestamp, updated_at=timestamp
+    )
+    serializer = TreeSerializer()
+
+    page = serializer.serialize_webpage(create_webpage(5, owner, project))
+    other_page = serializer.serialize_webpage(
+        create_webpage(6, owner, project)
+    )
+
+    assert page["status"] == "AVAILABLE"
+    assert page["created_at"] == "2024-10-01T12:30:00"
+    assert page["owner"]["name"] == "Owner"
+    assert page["owner"]["updated_at"] == "2024-10-01T12:30:00"
+    assert page["project"] == {
+        "id": 1,
+        "name": "ubuntu.com",
+        "created_at": "2024-10-01T12:30:00",
+        "updated_at": "2024-10-01T12:30:00",
+    }
+    # The id of the user replaces the id of the reviewer and the jira task
+    assert page["reviewers"][0]["id"] == 2
+    assert page["reviewers"][0]["name"] == "Reviewer"
+    assert page["reviewers"][0]["created_at"] == "2024-10-01T12:30:00"
+    assert page["jira_tasks"][0]["id"] == 2
+    assert page["jira_tasks"][0]["jira_id"] == "WD-1"
+    # Owners and projects are serialized once
+    assert other_page["owner"] is page["owner"]
+    assert other_page["project"] is page["project"]
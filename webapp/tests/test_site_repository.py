@@ -1,5 +1,36 @@
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import event, select
+
 from webapp import create_app
-from webapp.site_repository import SiteRepository
+from webapp.helper import (
+    get_webpage_ancestors,
+    get_webpage_breadcrumbs,
+    get_webpage_descendants,
+    move_webpage,
+)
+from webapp.models import (
+    JiraTask,
+    Project,
+    Reviewer,
+    User,
+    Webpage,
+    WebpageStatus,
+    bulk_update,
+    db,
+)
+from webapp.routes.tree import tree_blueprint
+from webapp.site_repository import SiteRepository, SiteRepositoryError
+from webapp.tests.fixtures import (
+    create_app_without_tasks,
+    create_file_cache,
+    create_tree,
+)
 
 
 def test_initialize_site_repository():
@@ -9,3 +40,501 @@ def test_initialize_site_repository():
         app,
     )
     assert site_repository.repository_uri == "ubuntu.com"
+
+
+def git(cwd, *args):
+    subprocess.run(
+        ["git", "-c", "user.name=Test", "-c", "user.email=test@example.com"]
+        + list(args),
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+    )
+
+
+def test_git_commands_run_in_repository(tmp_path):
+    app = create_app()
+    app.config["BASE_DIR"] = str(tmp_path)
+    # The base directory is itself a repository, as the app's is
+    git(tmp_path, "init")
+    repository = tmp_path / "repositories" / "ubuntu.com"
+    (repository / "templates").mkdir(parents=True)
+    (repository / "templates" / "index.html").write_text("<html></html>")
+    git(repository, "init")
+    git(repository, "add", "templates")
+    git(repository, "commit", "-m", "Add templates")
+    cwd = os.getcwd()
+
+    site_repository = SiteRepository("ubuntu.com", app)
+    assert len(site_repository.get_commit()) == 40
+    assert list(site_repository.get_template_blobs()) == ["index.html"]
+    assert os.getcwd() == cwd
+
+    # Commands in a directory that isn't a repository don't reach the
+    # repository of the base directory
+    (tmp_path / "repositories" / "canonical.com").mkdir()
+    site_repository = SiteRepository("canonical.com", app)
+    with pytest.raises(SiteRepositoryError, match="not a git repository"):
+        site_repository.get_commit()
+    assert os.getcwd() == cwd
+
+
+def test_get_tree_skips_sync_when_remote_is_unchanged(tmp_path, monkeypatch):
+    app = create_app()
+    app.config["CACHE"] = create_file_cache(app, tmp_path)
+    site_repository = SiteRepository("ubuntu.com", app)
+    monkeypatch.setattr(site_repository, "repository_exists", lambda: True)
+    monkeypatch.setattr(site_repository, "get_synced_commit", lambda: "abc")
+    monkeypatch.setattr(site_repository, "get_remote_commit", lambda: "abc")
+    monkeypatch.setattr(site_repository, "get_tree_sync", lambda: "tree")
+    monkeypatch.setattr(
+        site_repository,
+        "get_new_tree",
+        lambda: pytest.fail("The repository should not be synced"),
+    )
+
+    assert site_repository.get_tree(no_cache=True) == "tree"
+
+    # Sync once the remote branch has moved
+    monkeypatch.setattr(site_repository, "get_remote_commit", lambda: "def")
+    monkeypatch.setattr(site_repository, "get_new_tree", lambda: "new tree")
+    assert site_repository.get_tree(no_cache=True) == "new tree"
+
+
+def test_create_webpages_for_tree_in_bulk():
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        site_repository = SiteRepository("ubuntu.com", app, db=db)
+        statements = []
+        event.listen(
+            db.engine,
+            "before_cursor_execute",
+            lambda *args: statements.append(args[2]),
+        )
+
+        tree = site_repository.create_webpages_for_tree(db, create_tree())
+
+        webpages = {
+            webpage.name: webpage
+            for webpage in db.session.execute(select(Webpage)).scalars()
+        }
+        assert sorted(webpages) == ["", "/desktop", "/server", "/server/maas"]
+        assert webpages["/server/maas"].parent_id == webpages["/server"].id
+        assert webpages["/server"].parent_id == webpages[""].id
+        assert tree["children"][0]["children"][0]["id"] == (
+            webpages["/server/maas"].id
+        )
+        assert tree["children"][0]["project"]["name"] == "ubuntu.com"
+        # One INSERT per tree level
+        inserts = [s for s in statements if s.startswith("INSERT INTO web")]
+        assert len(inserts) == 3
+
+        assert sorted(site_repository.sync_changes["created"]) == sorted(
+            webpages
+        )
+
+        # Only the webpages that changed are updated, in a single statement
+        webpages["/desktop"].status = WebpageStatus.NEW
+        db.session.commit()
+        statements.clear()
+        tree = create_tree()
+        tree["children"][0]["title"] = "Ubuntu Server"
+        site_repository.create_webpages_for_tree(db, tree)
+
+        server = db.session.execute(
+            select(Webpage).where(Webpage.name == "/server")
+        ).scalar_one()
+        desktop = db.session.execute(
+            select(Webpage).where(Webpage.name == "/desktop")
+        ).scalar_one()
+        assert server.title == "Ubuntu Server"
+        assert desktop.status == WebpageStatus.AVAILABLE
+        assert site_repository.sync_changes == {
+            "created": [],
+            "updated": ["/server", "/desktop"],
+            "deleted": [],
+        }
+        assert len(statements) < 12
+
+        # Nothing is written if nothing changed
+        statements.clear()
+        site_repository.create_webpages_for_tree(db, tree)
+        assert site_repository.sync_changes == {
+            "created": [],
+            "updated": [],
+            "deleted": [],
+        }
+        assert not [s for s in statements if s.startswith("INSERT")]
+
+        # Webpages deleted during a sync aren't created again by the update
+        rows = [{"id": desktop.id, "title": "Desktop"}, {"id": 0, "title": ""}]
+        bulk_update(db.session, Webpage, rows, ["title"])
+        db.session.commit()
+        assert db.session.get(Webpage, 0) is None
+        assert desktop.title == "Desktop"
+        db.drop_all()
+
+
+def test_create_webpages_for_tree_updates_concurrent_webpages(monkeypatch):
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        site_repository = SiteRepository("ubuntu.com", app, db=db)
+        site_repository.create_webpages_for_tree(db, create_tree())
+        desktop = db.session.execute(
+            select(Webpage).where(Webpage.name == "/desktop")
+        ).scalar_one()
+        desktop.status = WebpageStatus.NEW
+        db.session.commit()
+
+        # The webpage is created by the app after the sync loaded webpages
+        monkeypatch.setattr(
+            SiteRepository,
+            "__get_project_webpages__",
+            lambda self, db, project: {},
+        )
+        tree = site_repository.create_webpages_for_tree(db, create_tree())
+
+        assert tree["children"][1]["id"] == desktop.id
+        db.session.refresh(desktop)
+        assert desktop.status == WebpageStatus.AVAILABLE
+        assert site_repository.sync_changes["created"] == []
+        db.drop_all()
+
+
+def test_create_webpages_for_tree_purges_removed_webpages():
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        site_repository = SiteRepository("ubuntu.com", app, db=db)
+        site_repository.create_webpages_for_tree(db, create_tree())
+        project = db.session.execute(
+            select(Project).where(Project.name == "ubuntu.com")
+        ).scalar_one()
+        other_project = Project(name="canonical.com")
+        user = User(name="Reviewer")
+        db.session.add_all([other_project, user])
+        db.session.flush()
+        removed = Webpage(
+            name="/removed",
+            url="/removed",
+            project_id=project.id,
+            status=WebpageStatus.TO_DELETE,
+        )
+        other_removed = Webpage(
+            name="/removed",
+            url="/removed",
+            project_id=other_project.id,
+            status=WebpageStatus.TO_DELETE,
+        )
+        db.session.add_all([removed, other_removed])
+        db.session.flush()
+        db.session.add_all(
+            [
+                Reviewer(user_id=user.id, webpage_id=removed.id),
+                JiraTask(jira_id="WD-1", webpage_id=removed.id),
+            ]
+        )
+        child = Webpage(
+            name="/removed/child",
+            url="/removed/child",
+            project_id=project.id,
+            parent_id=removed.id,
+            path=f"/{removed.id}/",
+            status=WebpageStatus.NEW,
+        )
+        db.session.add(child)
+        db.session.flush()
+        grandchild = Webpage(
+            name="/removed/child/page",
+            url="/removed/child/page",
+            project_id=project.id,
+            parent_id=child.id,
+            path=f"/{removed.id}/{child.id}/",
+            status=WebpageStatus.NEW,
+        )
+        db.session.add(grandchild)
+        db.session.commit()
+
+        site_repository.create_webpages_for_tree(db, create_tree())
+
+        assert site_repository.sync_changes["deleted"] == ["/removed"]
+        remaining = db.session.execute(
+            select(Webpage.project_id).where(Webpage.name == "/removed")
+        ).scalars()
+        assert list(remaining) == [other_project.id]
+        assert not db.session.execute(select(Reviewer)).all()
+        jira_task = db.session.execute(select(JiraTask)).scalar_one()
+        assert jira_task.webpage_id is None
+        # Children of removed webpages become the roots of their subtrees
+        db.session.expire_all()
+        assert (child.parent_id, child.path) == (None, "/")
+        assert grandchild.path == f"/{child.id}/"
+        db.drop_all()
+
+
+def test_get_tree_from_db(monkeypatch):
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        site_repository = SiteRepository("ubuntu.com", app, db=db)
+        # The tree is loaded from the repository if there are no webpages
+        monkeypatch.setattr(
+            site_repository,
+            "get_new_tree",
+            lambda: site_repository.create_webpages_for_tree(
+                db, create_tree()
+            ),
+        )
+        site_repository.get_tree_from_db()
+        user = User(name="Reviewer")
+        db.session.add(user)
+        db.session.flush()
+        server = db.session.execute(
+            select(Webpage).where(Webpage.name == "/server")
+        ).scalar_one()
+        db.session.add(Reviewer(user_id=user.id, webpage_id=server.id))
+        db.session.commit()
+        db.session.expunge_all()
+        statements = []
+        event.listen(
+            db.engine,
+            "before_cursor_execute",
+            lambda *args: statements.append(args[2]),
+        )
+
+        tree = site_repository.get_tree_from_db()
+
+        assert [child["name"] for child in tree["children"]] == [
+            "/desktop",
+            "/server",
+        ]
+        server = tree["children"][1]
+        assert server["children"][0]["name"] == "/server/maas"
+        assert server["reviewers"][0]["name"] == "Reviewer"
+        assert server["owner"]["name"] == "Default"
+        assert server["project"]["name"] == "ubuntu.com"
+        assert len(statements) == 4
+        db.drop_all()
+
+
+def test_webpage_paths():
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        site_repository = SiteRepository("ubuntu.com", app, db=db)
+        site_repository.create_webpages_for_tree(db, create_tree())
+        webpages = {
+            webpage.name: webpage
+            for webpage in db.session.execute(select(Webpage)).scalars()
+        }
+        root, server = webpages[""], webpages["/server"]
+        maas = webpages["/server/maas"]
+        assert root.path == "/"
+        assert server.path == f"/{root.id}/"
+        assert maas.path == f"/{root.id}/{server.id}/"
+
+        assert get_webpage_descendants(db.session, root) == [
+            webpages["/desktop"],
+            server,
+            maas,
+        ]
+        assert get_webpage_ancestors(db.session, maas) == [root, server]
+        assert [
+            page["name"] for page in get_webpage_breadcrumbs(db.session, maas)
+        ] == ["", "/server", "/server/maas"]
+
+        # Subtrees are moved in a single statement
+        statements = []
+        event.listen(
+            db.engine,
+            "before_cursor_execute",
+            lambda *args: statements.append(args[2]),
+        )
+        move_webpage(db.session, server, webpages["/desktop"])
+        assert len(statements) == 1
+        db.session.commit()
+        assert server.parent_id == webpages["/desktop"].id
+        assert server.path == f"/{root.id}/{webpages['/desktop'].id}/"
+        assert maas.path == f"{server.path}{server.id}/"
+        with pytest.raises(ValueError):
+            move_webpage(db.session, webpages["/desktop"], maas)
+
+        # Syncing the tree moves the webpages back
+        site_repository.create_webpages_for_tree(db, create_tree())
+        db.session.expire_all()
+        assert maas.path == f"/{root.id}/{server.id}/"
+
+        move_webpage(db.session, server, root, "/cloud")
+        db.session.commit()
+        assert server.name == "/cloud"
+        assert maas.name == maas.url == "/cloud/maas"
+        assert maas.path == f"/{root.id}/{server.id}/"
+        db.drop_all()
+
+
+@pytest.fixture
+def file_cache_app(tmp_path, monkeypatch):
+    monkeypatch.setattr(SiteRepository, "LAST_TREES", {})
+    monkeypatch.setattr(SiteRepository, "TREE_POLL_INTERVAL", 0.01)
+    app = create_app_without_tasks()
+    app.config["CACHE"] = create_file_cache(app, tmp_path)
+    return app
+
+
+def test_get_tree_sync_loads_tree_once(file_cache_app, monkeypatch):
+    loads = []
+
+    def get_tree_from_db(self):
+        loads.append(self.repository_uri)
+        time.sleep(0.2)
+        return {"name": "", "children": []}
+
+    monkeypatch.setattr(SiteRepository, "get_tree_from_db", get_tree_from_db)
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        trees = list(
+            executor.map(
+                lambda _: SiteRepository(
+                    "ubuntu.com", file_cache_app
+                ).get_tree_sync(),
+                range(5),
+            )
+        )
+
+    assert loads == ["ubuntu.com"]
+    assert trees == [{"name": "", "children": []}] * 5
+
+
+def test_get_tree_sync_waits_for_other_process(file_cache_app, monkeypatch):
+    monkeypatch.setattr(
+        SiteRepository,
+        "get_tree_from_db",
+        lambda self: pytest.fail("The tree should be loaded once"),
+    )
+    site_repository = SiteRepository("ubuntu.com", file_cache_app)
+    cache = file_cache_app.config["CACHE"]
+
+    # Another process is loading the tree
+    with cache.lock(site_repository.cache_key, 5):
+        timer = threading.Timer(
+            0.1, site_repository.set_tree_in_cache, [{"name": "loaded"}]
+        )
+        timer.start()
+        assert site_repository.get_tree_sync() == {"name": "loaded"}
+
+        # Serve the last tree if it isn't loaded in time
+        file_cache_app.config["TREE_LOAD_TIMEOUT"] = 0.1
+        assert site_repository.get_tree_sync(no_cache=True) == {
+            "name": "loaded"
+        }
+
+
+def test_get_tree_sync_serves_stale_tree(file_cache_app, monkeypatch):
+    loads = []
+
+    def get_tree_from_db(self):
+        loads.append(len(loads) + 1)
+        return {"name": f"version {len(loads)}"}
+
+    monkeypatch.setattr(SiteRepository, "get_tree_from_db", get_tree_from_db)
+    site_repository = SiteRepository("ubuntu.com", file_cache_app)
+    assert site_repository.get_tree_sync() == {"name": "version 1"}
+
+    # The stale tree is served while it is loaded again
+    site_repository.invalidate_cache()
+    assert site_repository.get_tree_sync() == {"name": "version 1"}
+    deadline = time.monotonic() + 2
+    while site_repository.get_tree_state()["stale_since"] is not None:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert site_repository.get_tree_sync() == {"name": "version 2"}
+    assert loads == [1, 2]
+
+    # Trees invalidated while loading stay stale
+    version = site_repository.get_tree_state()["version"]
+    site_repository.invalidate_cache()
+    site_repository.set_tree_in_cache({"name": "version 2"}, version)
+    assert site_repository.get_tree_state()["stale_since"] is not None
+
+    # Trees stale for too long are loaded before being served
+    file_cache_app.config["TREE_MAX_STALENESS"] = 0
+    assert site_repository.get_tree_sync() == {"name": "version 3"}
+
+
+def test_get_tree_route_refreshes_stale_tree(file_cache_app, monkeypatch):
+    loads = []
+
+    def get_tree_from_db(self):
+        loads.append(len(loads) + 1)
+        return {"name": f"version {len(loads)}"}
+
+    monkeypatch.setattr(SiteRepository, "get_tree_from_db", get_tree_from_db)
+    monkeypatch.setattr("webapp.sso.DISABLE_SSO", True)
+    app = file_cache_app
+    app.register_blueprint(tree_blueprint)
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    url = "/api/get-tree/ubuntu.com/main"
+    assert client.get(url).json["templates"] == {"name": "version 1"}
+
+    # Routes refresh stale trees in the background, out of their context
+    SiteRepository("ubuntu.com", app).invalidate_cache()
+    assert client.get(url).json["templates"] == {"name": "version 1"}
+    deadline = time.monotonic() + 2
+    while loads != [1, 2]:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert client.get(url).json["templates"] == {"name": "version 2"}
+    with app.app_context():
+        db.drop_all()
+
+
+class IndexedGraph:
+    def __init__(self, entries):
+        self.entries = entries
+
+    def get_index_entries(self):
+        return self.entries
+
+
+def test_update_template_index_keeps_concurrent_entries(file_cache_app):
+    ubuntu = SiteRepository("ubuntu.com", file_cache_app)
+    canonical = SiteRepository("canonical.com", file_cache_app)
+
+    # Both syncs read the index before either of them updates it
+    assert ubuntu.get_template_index() == canonical.get_template_index()
+    ubuntu.update_template_index(IndexedGraph({"a": {"name": "a"}}))
+    canonical.update_template_index(IndexedGraph({"b": {"name": "b"}}))
+    assert list(ubuntu.get_template_index()) == ["a", "b"]
+
+    # The index is left as is while another sync holds its lock
+    file_cache_app.config["TREE_LOAD_TIMEOUT"] = 0.05
+    cache = file_cache_app.config["CACHE"]
+    with cache.lock(SiteRepository.TEMPLATE_INDEX_KEY, 5):
+        ubuntu.update_template_index(IndexedGraph({"c": {"name": "c"}}))
+    assert list(ubuntu.get_template_index()) == ["a", "b"]
+
+
+def test_tree_is_cached_with_its_index(file_cache_app):
+    site_repository = SiteRepository("ubuntu.com", file_cache_app)
+    cache = file_cache_app.config["CACHE"]
+    tree = {"id": 1, "name": "", "children": [{"id": 2, "name": "/server"}]}
+
+    # Trees cached without their index aren't served
+    cache.set(site_repository.cache_key, tree)
+    assert site_repository.get_tree_from_cache() is None
+
+    site_repository.set_tree_in_cache(tree)
+    assert cache.get(site_repository.cache_key) == {
+        "tree": tree,
+        "index": {"1": [], "2": [0]},
+    }
+    assert site_repository.get_tree_from_cache() == tree
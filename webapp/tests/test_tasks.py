@@ -0,0 +1,50 @@
+import threading
+import time
+from queue import Queue
+
+from webapp import create_app
+from webapp.site_repository import SiteRepository
+from webapp.tasks import sync_sites
+
+
+def test_sync_sites_runs_concurrently_and_reports_failures(monkeypatch):
+    app = create_app()
+    app.config["SYNC_WORKERS"] = 3
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def get_tree(self, no_cache=False):
+        with lock:
+            running.append(self.repository_uri)
+            peak.append(len(running))
+        time.sleep(0.1)
+        with lock:
+            running.remove(self.repository_uri)
+        if self.repository_uri == "failing.com":
+            raise Exception("Clone failed")
+        return {"name": self.repository_uri}
+
+    monkeypatch.setattr(SiteRepository, "get_tree", get_tree)
+    queue = Queue()
+
+    results = sync_sites(
+        app, None, ["ubuntu.com", "failing.com", "canonical.com"], queue, {}
+    )
+
+    assert max(peak) == 3
+    assert [result["site"] for result in results] == [
+        "ubuntu.com",
+        "failing.com",
+        "canonical.com",
+    ]
+    assert [bool(result["error"]) for result in results] == [
+        False,
+        True,
+        False,
+    ]
+    assert all(result["duration"] >= 0.1 for result in results)
+    assert sorted(queue.get()["name"] for _ in range(2)) == [
+        "canonical.com",
+        "ubuntu.com",
+    ]
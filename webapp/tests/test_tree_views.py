@@ -0,0 +1,123 @@
+import pytest
+
+from webapp.helper import (
+    find_tree_node,
+    get_tree_index,
+    get_tree_view,
+    replace_tree_node,
+)
+from webapp.models import db
+from webapp.routes.tree import tree_blueprint
+from webapp.site_repository import SiteRepository
+from webapp.tests.fixtures import create_app_without_tasks
+
+
+def create_node(name, children=()):
+    return {"name": name, "title": name.title(), "children": list(children)}
+
+
+TREE = create_node(
+    "",
+    [
+        create_node(
+            "/server",
+            [
+                create_node(
+                    "/server/maas", [create_node("/server/maas/install")]
+                ),
+                create_node("/server/docs"),
+            ],
+        ),
+        create_node("/desktop"),
+    ],
+)
+
+
+def test_find_tree_node():
+    assert find_tree_node(TREE, "") is TREE
+    assert find_tree_node(TREE, "/server/maas/")["name"] == "/server/maas"
+    assert find_tree_node(TREE, "/server/maas/install")["children"] == []
+    assert find_tree_node(TREE, "/server/missing") is None
+
+
+def test_get_tree_view():
+    view = get_tree_view(TREE, depth=1, fields={"name"})
+
+    assert view == {
+        "name": "",
+        "children": [
+            {"name": "/server", "children": [], "children_count": 2},
+            {"name": "/desktop", "children": [], "children_count": 0},
+        ],
+    }
+    # The tree is not modified
+    assert TREE["children"][0]["title"] == "/Server"
+    assert len(TREE["children"][0]["children"]) == 2
+
+
+def test_replace_tree_node():
+    tree = create_node("", [create_node("/server"), create_node("/desktop")])
+    for id, node in enumerate([tree, *tree["children"]]):
+        node["id"] = id
+    index = get_tree_index(tree)
+    assert index == {"0": [], "1": [0], "2": [1]}
+
+    patched = replace_tree_node(tree, index["2"], {"title": "Linux"})
+    assert patched["children"][1]["title"] == "Linux"
+    # Only the nodes leading to the patched node are copied
+    assert patched["children"][0] is tree["children"][0]
+    assert tree["children"][1]["title"] == "/Desktop"
+
+    removed = replace_tree_node(tree, index["1"])
+    assert [child["id"] for child in removed["children"]] == [2]
+    assert len(tree["children"]) == 2
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr("webapp.sso.DISABLE_SSO", True)
+    monkeypatch.setattr(
+        SiteRepository, "get_tree_sync", lambda self, no_cache: TREE
+    )
+    app = create_app_without_tasks()
+    app.register_blueprint(tree_blueprint)
+    with app.app_context():
+        db.create_all()
+    yield app.test_client()
+    with app.app_context():
+        db.drop_all()
+
+
+def test_get_tree_subtree(client):
+    response = client.get(
+        "/api/get-tree/ubuntu.com/main?path=/server&depth=1&fields=name,title"
+    )
+
+    assert response.status_code == 200
+    assert response.json["templates"] == {
+        "name": "/server",
+        "title": "/Server",
+        "children": [
+            {
+                "name": "/server/maas",
+                "title": "/Server/Maas",
+                "children": [],
+                "children_count": 1,
+            },
+            {
+                "name": "/server/docs",
+                "title": "/Server/Docs",
+                "children": [],
+                "children_count": 0,
+            },
+        ],
+    }
+
+
+def test_get_tree_errors(client):
+    assert client.get(
+        "/api/get-tree/ubuntu.com/main?depth=-1"
+    ).status_code == (400)
+    assert client.get(
+        "/api/get-tree/ubuntu.com/main?path=/missing"
+    ).status_code == (404)